@@ -1,13 +1,15 @@
-from fastapi import APIRouter, Depends, Request, UploadFile, File, Form
-from services.doc_agent import create_agreement_details, AgreementRequest
+from typing import Optional
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, UploadFile, File, Form
+from services.doc_agent import AgreementRequest
 from auth.clerk_auth import requires_auth
 from database.connection import get_db
 from prisma import Prisma
 from prisma.enums import AgreementStatus
-from services.template_doc_agent import (
-    template_based_agreement,
-    TemplateAgreementRequest,
-)
+from prisma.errors import UniqueViolationError
+from services.template_doc_agent import TemplateAgreementRequest
+from helpers.job_manager import job_manager, job_to_dict
+from helpers.generation_limiter import GenerationQueueFullError, generation_limiter
+from api.routes.websocket import notify_clients
 from services.email_verification import (
     send_otp_endpoint,
     OTPRequest,
@@ -18,42 +20,87 @@ from services.email_verification import (
 router = APIRouter()
 
 
-@router.post("/create-agreement")
-@requires_auth
-async def create_agreement(
-    agreement: AgreementRequest, request: Request, db: Prisma = Depends(get_db)
-):
-    agreements = await db.agreement.create(
-        data={
-            "address": agreement.property_address,
-            "city": agreement.city,
-            "rentAmount": agreement.rent_amount,
-            "agreementPeriod": agreement.agreement_period,
-            "status": AgreementStatus.PROCESSING,
-            "clerkUserIds": [agreement.user_id],
-        }
-    )
-
-    await db.owner.create(
-        data={
-            "agreementId": agreements.id,
-            "name": agreement.owner_name,
-            "email": agreement.owner_email,
-        }
-    )
-    for tenant in agreement.tenant_details:
-        await db.tenant.create(
-            data={
-                "agreementId": agreements.id,
-                "name": tenant.get("name"),
-                "email": tenant.get("email"),
-            }
+async def admit_generation(db: Prisma) -> None:
+    """Fails fast with 503 and a Retry-After estimate when the generation queue is full."""
+    queued = await job_manager.queued_count(db)
+    try:
+        generation_limiter.admit(queued)
+    except GenerationQueueFullError as e:
+        raise HTTPException(
+            status_code=503,
+            detail="Too many agreements are being generated, please retry later",
+            headers={"Retry-After": str(e.retry_after)},
         )
 
-    return await create_agreement_details(agreement, agreements.id, db)
 
+async def find_idempotent_job(db: Prisma, user_id: str, idempotency_key: Optional[str]):
+    """Returns the job an earlier request with the same Idempotency-Key created, if any."""
+    if not idempotency_key:
+        return None
+    return await job_manager.get_by_idempotency_key(db, user_id, idempotency_key)
 
-@router.post("/create-template-based-agreement")
+
+@router.post("/create-agreement", status_code=202)
+@requires_auth
+async def create_agreement(
+    agreement: AgreementRequest,
+    request: Request,
+    idempotency_key: Optional[str] = Header(None),
+    db: Prisma = Depends(get_db),
+):
+    existing_job = await find_idempotent_job(db, agreement.user_id, idempotency_key)
+    if existing_job:
+        return job_to_dict(existing_job)
+
+    await admit_generation(db)
+    try:
+        # The rows and the job commit together, so a concurrent retry with the same
+        # key rolls back entirely on the unique constraint
+        async with db.tx() as tx:
+            agreements = await tx.agreement.create(
+                data={
+                    "address": agreement.property_address,
+                    "city": agreement.city,
+                    "rentAmount": agreement.rent_amount,
+                    "agreementPeriod": agreement.agreement_period,
+                    "status": AgreementStatus.PROCESSING,
+                    "clerkUserIds": [agreement.user_id],
+                }
+            )
+
+            await tx.owner.create(
+                data={
+                    "agreementId": agreements.id,
+                    "name": agreement.owner_name,
+                    "email": agreement.owner_email,
+                }
+            )
+            for tenant in agreement.tenant_details:
+                await tx.tenant.create(
+                    data={
+                        "agreementId": agreements.id,
+                        "name": tenant.get("name"),
+                        "email": tenant.get("email"),
+                    }
+                )
+
+            job = await job_manager.enqueue(
+                tx,
+                "rent",
+                agreements.id,
+                agreement.user_id,
+                agreement.model_dump(mode="json"),
+                priority=agreement.priority or 0,
+                idempotency_key=idempotency_key,
+            )
+    except UniqueViolationError:
+        return job_to_dict(await find_idempotent_job(db, agreement.user_id, idempotency_key))
+
+    await job_manager.announce(job)
+    return job_to_dict(job)
+
+
+@router.post("/create-template-based-agreement", status_code=202)
 @requires_auth
 async def create_template_based_agreement(
     request: Request,
@@ -62,30 +109,109 @@ async def create_template_based_agreement(
     participant_email: str = Form(...),
     file: UploadFile = File(...),
     user_id: str = Form(...),
+    priority: int = Form(0),
+    idempotency_key: Optional[str] = Header(None),
     db: Prisma = Depends(get_db),
 ):
+    existing_job = await find_idempotent_job(db, user_id, idempotency_key)
+    if existing_job:
+        return job_to_dict(existing_job)
+
+    await admit_generation(db)
     req = TemplateAgreementRequest(
         user_prompt=user_prompt,
         authority_email=authority_email,
         participant_email=participant_email,
     )
-    agreements = await db.templateagreement.create(
-        data={"status": AgreementStatus.PROCESSING, "clerkUserIds": [user_id]}
-    )
+    template_file = await file.read()
+    try:
+        async with db.tx() as tx:
+            agreements = await tx.templateagreement.create(
+                data={"status": AgreementStatus.PROCESSING, "clerkUserIds": [user_id]}
+            )
+
+            await tx.authority.create(
+                data={
+                    "agreementId": agreements.id,
+                    "email": authority_email,
+                }
+            )
+            await tx.participant.create(
+                data={
+                    "agreementId": agreements.id,
+                    "email": participant_email,
+                }
+            )
+            # The template is stored with the job so any worker can pick it up
+            job = await job_manager.enqueue(
+                tx,
+                "template",
+                agreements.id,
+                user_id,
+                req.model_dump(),
+                priority=priority,
+                template_file=template_file,
+                template_file_name=file.filename,
+                idempotency_key=idempotency_key,
+            )
+    except UniqueViolationError:
+        return job_to_dict(await find_idempotent_job(db, user_id, idempotency_key))
+
+    await job_manager.announce(job)
+    return job_to_dict(job)
+
+
+async def cancel_agreement_job(db: Prisma, agreement_id: int, user_id: str, is_template: bool):
+    """Cancels the agreement's job and marks the agreement CANCELLED."""
+    table = db.templateagreement if is_template else db.agreement
+    agreement = await table.find_first(where={"id": agreement_id})
+    if not agreement or user_id not in agreement.clerkUserIds:
+        raise HTTPException(status_code=404, detail="Agreement not found")
+    if agreement.status != AgreementStatus.PROCESSING:
+        raise HTTPException(
+            status_code=409, detail=f"Agreement is already {agreement.status}"
+        )
 
-    await db.authority.create(
-        data={
-            "agreementId": agreements.id,
-            "email": authority_email,
-        }
+    if not await job_manager.cancel(db, "template" if is_template else "rent", agreement_id):
+        # The job finished between the status check and the cancel, and its
+        # outcome stands
+        raise HTTPException(status_code=409, detail="Agreement job has already finished")
+    # The run can still finish the agreement before the job stops, and then
+    # its outcome stands
+    cancelled = await table.update_many(
+        where={"id": agreement_id, "status": AgreementStatus.PROCESSING},
+        data={"status": AgreementStatus.CANCELLED},
     )
-    await db.participant.create(
-        data={
-            "agreementId": agreements.id,
-            "email": participant_email,
-        }
-    )
-    return await template_based_agreement(req, file, agreements.id, db)
+    if not cancelled:
+        raise HTTPException(status_code=409, detail="Agreement has already finished")
+    response = {"status": AgreementStatus.CANCELLED, "agreement_id": agreement_id}
+    await notify_clients(response, agreement_id, is_template)
+    return response
+
+
+@router.delete("/agreements/{agreement_id}")
+@requires_auth
+async def cancel_agreement(
+    agreement_id: int, user_id: str, request: Request, db: Prisma = Depends(get_db)
+):
+    return await cancel_agreement_job(db, agreement_id, user_id, False)
+
+
+@router.delete("/template-agreements/{agreement_id}")
+@requires_auth
+async def cancel_template_agreement(
+    agreement_id: int, user_id: str, request: Request, db: Prisma = Depends(get_db)
+):
+    return await cancel_agreement_job(db, agreement_id, user_id, True)
+
+
+@router.get("/jobs/{job_id}")
+@requires_auth
+async def get_job(job_id: int, user_id: str, request: Request, db: Prisma = Depends(get_db)):
+    job = await job_manager.get(db, job_id)
+    if not job or job.userId != user_id:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job_to_dict(job)
 
 
 @router.get("/agreements")
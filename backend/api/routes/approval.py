@@ -2,7 +2,8 @@ import os
 import shutil
 from fastapi import APIRouter, Depends, Request
 from fastapi.responses import JSONResponse
-from api.routes.websocket import notify_clients
+from api.routes.websocket import agreement_channel, notify_clients
+from helpers.approval_bus import approval_bus
 from helpers.email_helper import send_rejection_email
 from helpers.state_manager import AgreementState, TemplateAgreementState, state_manager
 from services.doc_agent import delete_temp_file, delete_temp_images
@@ -21,8 +22,6 @@ from auth.clerk_auth import requires_auth
 from prisma.enums import AgreementStatus
 
 router = APIRouter()
-approved_users = set()
-rejected_users = set()
 
 
 @router.post("/approve")
@@ -48,21 +47,22 @@ async def approve_user(data: Data, request: Request, db: Prisma = Depends(get_db
             }
         )
 
-    approved_users.add(data.user)
     response = {
         "status": AgreementStatus.APPROVED,
         "user_id": data.user,
         "approved": True,
         "agreement_type": agreement_type,
+        "agreement_id": data.agreement_id,
     }
-    await notify_clients(response)
+    is_template = agreement_type == "template"
+    await approval_bus.publish(agreement_channel(data.agreement_id, is_template), response)
+    await notify_clients(response, data.agreement_id, is_template)
     return JSONResponse(content=response)
 
 
 @router.post("/reject")
 @requires_auth
 async def reject_user(data: Data, request: Request, db: Prisma = Depends(get_db)):
-    rejected_users.add(data.user)
     agreement_type = data.agreement_type
     if agreement_type == "rent":
         await db.userrentagreementstatus.create(
@@ -86,9 +86,9 @@ async def reject_user(data: Data, request: Request, db: Prisma = Depends(get_db)
     rejected_by_role = None
 
     current_state = (
-        state_manager.get_agreement_state(data.agreement_id) 
-        if data.agreement_type == "rent" 
-        else state_manager.get_template_agreement_state(data.agreement_id)
+        await state_manager.load_agreement_state(data.agreement_id)
+        if data.agreement_type == "rent"
+        else await state_manager.load_template_agreement_state(data.agreement_id)
     )
 
     if isinstance(current_state, AgreementState):
@@ -96,7 +96,7 @@ async def reject_user(data: Data, request: Request, db: Prisma = Depends(get_db)
             rejected_by_name = current_state.owner_name
             rejected_by_role = "owner"
         elif data.user in current_state.tenants:
-            rejected_by_name = current_state.tenant_names[data.user]
+            rejected_by_name = current_state.tenants[data.user].name
             rejected_by_role = "tenant"
     elif isinstance(current_state, TemplateAgreementState):
         if data.user == current_state.authority_id:
@@ -129,6 +129,9 @@ async def reject_user(data: Data, request: Request, db: Prisma = Depends(get_db)
         "user_id": data.user,
         "approved": False,
         "agreement_type": agreement_type,
+        "agreement_id": data.agreement_id,
     }
-    await notify_clients(response)
+    is_template = agreement_type == "template"
+    await approval_bus.publish(agreement_channel(data.agreement_id, is_template), response)
+    await notify_clients(response, data.agreement_id, is_template)
     return JSONResponse(content=response)
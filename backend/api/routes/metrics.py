@@ -0,0 +1,22 @@
+from fastapi import APIRouter, Depends, Request
+from prisma import Prisma
+from auth.clerk_auth import requires_auth, token_cache
+from api.routes.websocket import registry
+from database.connection import get_db
+from helpers.generation_limiter import generation_limiter
+from helpers.job_manager import job_manager
+from helpers.state_sweeper import state_sweeper
+
+router = APIRouter()
+
+
+@router.get("/metrics")
+@requires_auth
+async def get_metrics(request: Request, db: Prisma = Depends(get_db)):
+    return {
+        "auth": {"verified_token_cache": token_cache.stats()},
+        "websocket": registry.stats(),
+        "jobs": {"queued": await job_manager.queued_count(db), **job_manager.stats()},
+        "generation": generation_limiter.stats(),
+        "state": state_sweeper.stats(),
+    }
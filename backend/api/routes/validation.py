@@ -3,6 +3,7 @@ import base64
 import os
 import random
 from auth.clerk_auth import requires_auth
+from constants import UPLOAD_DIR
 from helpers.state_manager import state_manager
 from helpers.image_validation import are_faces_different, validate_uploaded_image
 
@@ -31,7 +32,11 @@ async def validate_image(request: Request):
             detail="Invalid image format. Only JPEG and PNG are supported.",
         )
 
-    save_dir = "./utils"
+    current_state = await state_manager.load_agreement_state(agreement_id)
+    if current_state is None:
+        raise HTTPException(status_code=404, detail="Agreement not found")
+
+    save_dir = UPLOAD_DIR
     os.makedirs(save_dir, exist_ok=True)
 
     try:
@@ -44,13 +49,11 @@ async def validate_image(request: Request):
         raise HTTPException(status_code=500, detail=f"Error processing image: {str(e)}")
 
     image_paths = []
-    current_state = state_manager.get_agreement_state(agreement_id)
     if current_state.owner_photo:
         image_paths.append(current_state.owner_photo)
-    if current_state.tenant_photos:
-        image_paths.extend(
-            photo for photo in current_state.tenant_photos.values() if photo
-        )
+    image_paths.extend(
+        tenant.photo for tenant in current_state.tenants.values() if tenant.photo
+    )
 
     image_paths.append(photo_path)
     try:
@@ -1,21 +1,346 @@
+import asyncio
+import json
+import logging
+import time
+from collections import Counter, OrderedDict, defaultdict, deque
+from typing import Dict, List, Optional, Set
 from fastapi import APIRouter, WebSocket
+from constants import (
+    WEBSOCKET_REPLAY_BUFFER_SIZE,
+    WEBSOCKET_REPLAY_MAX_CHANNELS,
+    WEBSOCKET_SEND_QUEUE_SIZE,
+)
+from config import (
+    WEBSOCKET_AUTH_TIMEOUT_SECONDS,
+    WEBSOCKET_IDLE_TIMEOUT_SECONDS,
+    WEBSOCKET_MAX_CONNECTIONS_PER_USER,
+    WEBSOCKET_PING_INTERVAL_SECONDS,
+    WEBSOCKET_TRUST_FORWARDED_FOR,
+)
+from helpers.backplane import backplane
+from auth.clerk_auth import token_cache, verify_token_async
 
 router = APIRouter()
-active_connections = []
+logger = logging.getLogger(__name__)
+
+
+def agreement_channel(agreement_id: int, is_template: bool = False) -> str:
+    """Returns the channel name that events for an agreement are routed to."""
+    agreement_type = "template" if is_template else "rent"
+    return f"{agreement_type}:{agreement_id}"
+
+
+class ClientConnection:
+    """A subscribed WebSocket with its own bounded outbound queue, writer and heartbeat tasks."""
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        channel: str,
+        client_key: Optional[str] = None,
+        max_queue_size: int = WEBSOCKET_SEND_QUEUE_SIZE,
+    ):
+        self.websocket = websocket
+        self.channel = channel
+        self.client_key = client_key
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue_size)
+        self.last_activity = time.monotonic()
+        self._writer_task = None
+        self._heartbeat_task = None
+
+    def start(self) -> None:
+        self._writer_task = asyncio.create_task(self._write_loop())
+        self._heartbeat_task = asyncio.create_task(self._heartbeat_loop())
+
+    def touch(self) -> None:
+        """Records inbound traffic from the client, which includes pong replies."""
+        self.last_activity = time.monotonic()
+
+    async def _write_loop(self) -> None:
+        try:
+            while True:
+                message = await self.queue.get()
+                await self.websocket.send_text(message)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.info(f"Dropping connection on {self.channel} after send failure: {e}")
+            registry.unsubscribe(self)
+
+    async def _heartbeat_loop(self) -> None:
+        while True:
+            await asyncio.sleep(WEBSOCKET_PING_INTERVAL_SECONDS)
+            if time.monotonic() - self.last_activity >= WEBSOCKET_IDLE_TIMEOUT_SECONDS:
+                logger.info(f"Reaping idle connection on {self.channel}")
+                registry.reap(self)
+                # 1001: going away
+                await self.close(code=1001)
+                return
+            self.enqueue(PING_MESSAGE)
+
+    def enqueue(self, message: str) -> bool:
+        """Queues an already serialized message, returning False if the client is too slow."""
+        try:
+            self.queue.put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    async def close(self, code: int = 1000) -> None:
+        current_task = asyncio.current_task()
+        for task in (self._writer_task, self._heartbeat_task):
+            if task and task is not current_task and not task.done():
+                task.cancel()
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass  # Already closed by the client
+
+
+class ConnectionRegistry:
+    """Indexes active WebSocket connections by the agreement channel they subscribed to."""
+
+    def __init__(self, max_connections_per_user: int = WEBSOCKET_MAX_CONNECTIONS_PER_USER):
+        self.max_connections_per_user = max_connections_per_user
+        self._channels: Dict[str, Set[ClientConnection]] = defaultdict(set)
+        self._client_connections: Counter = Counter()
+        self.open_connections = 0
+        self.reaped_connections = 0
+        self.dropped_connections = 0
+        self.rejected_connections = 0
+
+    def can_accept(self, client_key: Optional[str]) -> bool:
+        if client_key and self._client_connections[client_key] >= self.max_connections_per_user:
+            self.rejected_connections += 1
+            return False
+        return True
+
+    def subscribe(self, connection: ClientConnection) -> None:
+        connections = self._channels[connection.channel]
+        if connection in connections:
+            return
+        connections.add(connection)
+        self.open_connections += 1
+        if connection.client_key:
+            self._client_connections[connection.client_key] += 1
+
+    def unsubscribe(self, connection: ClientConnection) -> bool:
+        """Removes the connection, returning False if it was already removed."""
+        connections = self._channels.get(connection.channel)
+        if connections is None or connection not in connections:
+            return False
+        connections.discard(connection)
+        if not connections:
+            del self._channels[connection.channel]
+        self.open_connections -= 1
+        if connection.client_key:
+            self._client_connections[connection.client_key] -= 1
+            if self._client_connections[connection.client_key] <= 0:
+                del self._client_connections[connection.client_key]
+        return True
+
+    def reap(self, connection: ClientConnection) -> None:
+        if self.unsubscribe(connection):
+            self.reaped_connections += 1
+
+    def drop(self, connection: ClientConnection) -> None:
+        if self.unsubscribe(connection):
+            self.dropped_connections += 1
+
+    def connections(self, channel: str) -> Set[ClientConnection]:
+        return self._channels.get(channel, set())
+
+    def stats(self) -> dict:
+        return {
+            "open_connections": self.open_connections,
+            "open_channels": len(self._channels),
+            "reaped_connections": self.reaped_connections,
+            "dropped_connections": self.dropped_connections,
+            "rejected_connections": self.rejected_connections,
+        }
+
+
+registry = ConnectionRegistry()
+
+
+def serialize(response: dict) -> str:
+    # Same encoding as WebSocket.send_json
+    return json.dumps(response, separators=(",", ":"), ensure_ascii=False)
+
+
+PING_MESSAGE = serialize({"type": "ping"})
+
+
+class ChannelHistory:
+    """Keeps the most recent events of each channel, by their publish-time seq, for reconnecting clients."""
+
+    def __init__(
+        self,
+        max_events: int = WEBSOCKET_REPLAY_BUFFER_SIZE,
+        max_channels: int = WEBSOCKET_REPLAY_MAX_CHANNELS,
+    ):
+        self.max_events = max_events
+        self.max_channels = max_channels
+        # channel -> (last sequence number, ring buffer of (seq, message))
+        self._channels: OrderedDict = OrderedDict()
+
+    def record(self, channel: str, seq: int, response: dict) -> str:
+        """Keeps the event under the sequence number it was published with and returns it serialized."""
+        message = serialize({**response, "seq": seq})
+        last_seq, events = self._channels.get(channel, (0, None))
+        if events is None:
+            events = deque(maxlen=self.max_events)
+        if seq > last_seq:
+            events.append((seq, message))
+            self._channels[channel] = (seq, events)
+            self._channels.move_to_end(channel)
+            while len(self._channels) > self.max_channels:
+                self._channels.popitem(last=False)
+        return message
+
+    def last_seq(self, channel: str) -> int:
+        return self._channels.get(channel, (0, None))[0]
+
+    def since(self, channel: str, last_seq: int) -> Optional[List[str]]:
+        """Returns the events after last_seq, or None if this worker cannot show none were missed."""
+        current_seq, events = self._channels.get(channel, (0, None))
+        if events is None or last_seq > current_seq:
+            # Nothing buffered for the channel, or this worker is behind the client
+            return None
+        missed = [(seq, message) for seq, message in events if seq > last_seq]
+        # Sequence numbers are assigned at publish time, so a hole means the
+        # buffer rolled over or this worker missed an event
+        if [seq for seq, _ in missed] != list(range(last_seq + 1, current_seq + 1)):
+            return None
+        return [message for _, message in missed]
+
+
+history = ChannelHistory()
+
+
+class WebSocketAuthError(Exception):
+    pass
+
+
+async def receive_auth_token(websocket: WebSocket) -> Optional[str]:
+    """Reads the client's first message, {"type": "auth", "token": ...}.
+
+    The token is sent as a message rather than in the URL so it stays out of
+    proxy and access logs. Anonymous clients send the message without a token.
+    """
+    try:
+        message = json.loads(
+            await asyncio.wait_for(
+                websocket.receive_text(), timeout=WEBSOCKET_AUTH_TIMEOUT_SECONDS
+            )
+        )
+    except (asyncio.TimeoutError, ValueError) as e:
+        raise WebSocketAuthError(f"no auth message: {e}")
+    if not isinstance(message, dict) or message.get("type") != "auth":
+        raise WebSocketAuthError("first message is not an auth message")
+    return message.get("token") or None
+
+
+def client_address(websocket: WebSocket) -> Optional[str]:
+    """Returns the address anonymous connections are capped by, or None to leave them uncapped."""
+    if not WEBSOCKET_TRUST_FORWARDED_FOR:
+        return None
+    # The trusted proxy appends the address it saw, so earlier entries are client controlled
+    forwarded_for = websocket.headers.get("x-forwarded-for", "")
+    addresses = [address.strip() for address in forwarded_for.split(",") if address.strip()]
+    if addresses:
+        return addresses[-1]
+    return websocket.client.host if websocket.client else None
+
+
+async def connection_key(websocket: WebSocket) -> Optional[str]:
+    """Returns the key the per-user cap is counted against, or None for an uncapped connection.
+
+    Signed-in clients are counted by the subject of their verified token and
+    anonymous ones by their address when it can be trusted.
+    Raises WebSocketAuthError if the client does not authenticate.
+    """
+    token = await receive_auth_token(websocket)
+    if token:
+        try:
+            payload = token_cache.get(token)
+            if payload is None:
+                payload = await verify_token_async(token)
+                token_cache.put(token, payload)
+        except Exception as e:
+            raise WebSocketAuthError(f"invalid token: {e}")
+        return f"user:{payload['sub']}"
+    address = client_address(websocket)
+    return f"address:{address}" if address else None
 
 
 @router.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket):
+async def websocket_endpoint(
+    websocket: WebSocket,
+    agreement_id: int,
+    agreement_type: str = "rent",
+    last_seq: Optional[int] = None,
+):
+    channel = agreement_channel(agreement_id, agreement_type == "template")
     await websocket.accept()
-    active_connections.append(websocket)
+    try:
+        client_key = await connection_key(websocket)
+    except WebSocketAuthError as e:
+        logger.info(f"Rejecting WebSocket: {e}")
+        # 1008: policy violation
+        await websocket.close(code=1008)
+        return
+    except Exception:
+        return  # Disconnected before authenticating
+    # Checked after the last await before subscribing so the per-user cap cannot be raced
+    if not registry.can_accept(client_key):
+        await websocket.close(code=1008)
+        return
+    connection = ClientConnection(websocket, channel, client_key)
+    # Replay and subscribe without awaiting in between so no event is missed or repeated
+    if last_seq is not None:
+        missed = history.since(channel, last_seq)
+        if missed is None:
+            resync = {"type": "resync"}
+            if history.last_seq(channel):
+                resync["seq"] = history.last_seq(channel)
+            missed = [serialize(resync)]
+        for message in missed:
+            connection.enqueue(message)
+    registry.subscribe(connection)
+    connection.start()
     try:
         while True:
-            await websocket.receive_text()  # Keep connection alive
-    except:
-        active_connections.remove(websocket)
+            await websocket.receive_text()
+            connection.touch()
+    except Exception:
+        pass
+    finally:
+        registry.unsubscribe(connection)
+        await connection.close()
+
+
+async def notify_clients(response: dict, agreement_id: int, is_template: bool = False):
+    """Notify the WebSocket clients subscribed to the given agreement on every worker."""
+    channel = agreement_channel(agreement_id, is_template)
+    # Numbered once here so every worker replays the same seq to reconnecting clients
+    await backplane.publish_numbered(
+        "notify", channel, {"channel": channel, "response": response}
+    )
+
+
+def deliver_to_clients(event: dict) -> None:
+    """Queues a backplane event for the clients connected to this worker."""
+    channel = event["channel"]
+    # Serialize once for every subscriber
+    message = history.record(channel, event["seq"], event["response"])
+    # Copy since dropping a slow consumer mutates the channel set
+    for connection in list(registry.connections(channel)):
+        if not connection.enqueue(message):
+            logger.warning(f"Dropping slow consumer on {channel}: send queue is full")
+            registry.drop(connection)
+            # 1013: try again later
+            asyncio.create_task(connection.close(code=1013))
 
 
-async def notify_clients(response: dict):
-    """Notify all active WebSocket clients."""
-    for connection in active_connections:
-        await connection.send_json(response)
+backplane.on("notify", deliver_to_clients)
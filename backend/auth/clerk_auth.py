@@ -1,100 +1,260 @@
 import os
+import asyncio
+import hashlib
+import threading
+import time
+from collections import OrderedDict
 from functools import wraps
 from fastapi import Request, HTTPException
-import requests
-from jose import jwt
+import httpx
+from jose import jwk, jwt
 from jose.exceptions import JWTError, ExpiredSignatureError
 import logging
 from datetime import datetime
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+from constants import (
+    JWKS_CACHE_TTL_SECONDS,
+    JWKS_FAILURE_BACKOFF_SECONDS,
+    JWKS_MIN_REFRESH_SECONDS,
+    VERIFIED_TOKEN_CACHE_SIZE,
+)
 
 logger = logging.getLogger(__name__)
 
-# Configure retry strategy
-retry_strategy = Retry(
-    total=3,
-    backoff_factor=0.5,
-    status_forcelist=[500, 502, 503, 504],
+# Shared async client used to fetch the JWKS
+async_client = httpx.AsyncClient(
+    timeout=10, headers={"Accept": "application/json"}
 )
-
-# Create session with retry strategy
-session = requests.Session()
-adapter = HTTPAdapter(max_retries=retry_strategy)
-session.mount("http://", adapter)
-session.mount("https://", adapter)
+JWKS_FETCH_ATTEMPTS = 4
+JWKS_RETRY_STATUSES = {500, 502, 503, 504}
 
 
-def get_jwks():
-    """Fetch the JWKS from Clerk"""
+async def get_jwks_async():
+    """Fetch the JWKS from Clerk without blocking the event loop"""
     clerk_issuer = os.getenv("CLERK_ISSUER")
     if not clerk_issuer:
         logger.error("CLERK_ISSUER environment variable not set")
         raise JWTError("Clerk configuration missing")
 
+    logger.info(f"Fetching JWKS from {clerk_issuer}")
+    # Retries connection errors and 5xx responses with exponential backoff
+    for attempt in range(JWKS_FETCH_ATTEMPTS):
+        try:
+            response = await async_client.get(f"{clerk_issuer}/.well-known/jwks.json")
+            if (
+                response.status_code in JWKS_RETRY_STATUSES
+                and attempt < JWKS_FETCH_ATTEMPTS - 1
+            ):
+                raise httpx.HTTPStatusError(
+                    f"Server error {response.status_code}",
+                    request=response.request,
+                    response=response,
+                )
+            response.raise_for_status()
+            return response.json()
+        except httpx.HTTPError as e:
+            is_retryable = not isinstance(e, httpx.HTTPStatusError) or (
+                e.response.status_code in JWKS_RETRY_STATUSES
+            )
+            if attempt == JWKS_FETCH_ATTEMPTS - 1 or not is_retryable:
+                logger.error(f"Failed to fetch JWKS: {str(e)}")
+                raise JWTError(f"Failed to fetch JWKS: {str(e)}")
+            await asyncio.sleep(0.5 * (2**attempt))
+
+
+async def close_async_client():
+    await async_client.aclose()
+
+
+class JWKSCache:
+    """Caches the Clerk signing keys by kid and refreshes them on expiry or on an unknown kid."""
+
+    def __init__(
+        self,
+        ttl_seconds: int = JWKS_CACHE_TTL_SECONDS,
+        min_refresh_seconds: int = JWKS_MIN_REFRESH_SECONDS,
+        failure_backoff_seconds: int = JWKS_FAILURE_BACKOFF_SECONDS,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.min_refresh_seconds = min_refresh_seconds
+        self.failure_backoff_seconds = failure_backoff_seconds
+        self._keys = {}
+        self._prepared_keys = {}
+        # Time of the last fetch attempt, successful or not
+        self._fetched_at = 0.0
+        self._expires_at = 0.0
+        self._lock = asyncio.Lock()
+
+    def _is_fresh(self) -> bool:
+        return bool(self._keys) and time.monotonic() < self._expires_at
+
+    def _can_refresh_for_missing_kid(self) -> bool:
+        # Unknown kids are attacker controlled, so they may only trigger a refetch
+        # once per min_refresh_seconds.
+        return time.monotonic() - self._fetched_at >= self.min_refresh_seconds
+
+    def _needs_refresh(self, kid: str) -> bool:
+        if not self._is_fresh():
+            return True
+        if kid not in self._keys and self._can_refresh_for_missing_kid():
+            logger.info(f"Key {kid} not found in cached JWKS, refreshing")
+            return True
+        return False
+
+    def _store(self, jwks: dict) -> None:
+        keys = {}
+        prepared_keys = {}
+        for key in jwks.get("keys", []):
+            keys[key["kid"]] = key
+            try:
+                prepared_keys[key["kid"]] = jwk.construct(key, "RS256")
+            except JWTError as e:
+                logger.warning(f"Skipping unusable JWK {key['kid']}: {str(e)}")
+        self._keys = keys
+        self._prepared_keys = prepared_keys
+        self._fetched_at = time.monotonic()
+        self._expires_at = self._fetched_at + self.ttl_seconds
+
+    def _store_failure(self, error: JWTError) -> None:
+        if not self._keys:
+            raise error
+        # Keep serving the last known keys while Clerk is unreachable, but try
+        # again after the short backoff rather than the full TTL.
+        logger.warning("Using stale JWKS after refresh failure")
+        self._fetched_at = time.monotonic()
+        self._expires_at = self._fetched_at + self.failure_backoff_seconds
+
+    async def _refresh_async(self, stale_fetched_at: float) -> None:
+        # Single-flight: only the first caller that sees a stale cache fetches,
+        # everyone queued behind the lock reuses its result.
+        async with self._lock:
+            if self._fetched_at != stale_fetched_at:
+                return
+            try:
+                jwks = await get_jwks_async()
+            except JWTError as e:
+                self._store_failure(e)
+                return
+            self._store(jwks)
+
+    async def get_prepared_key(self, kid: str):
+        """Returns the pre-built key object for the given kid without blocking the event loop."""
+        fetched_at = self._fetched_at
+        if self._needs_refresh(kid):
+            await self._refresh_async(fetched_at)
+        return self._prepared_keys.get(kid)
+
+    def clear(self) -> None:
+        self._keys = {}
+        self._prepared_keys = {}
+        self._fetched_at = 0.0
+        self._expires_at = 0.0
+
+
+jwks_cache = JWKSCache()
+
+
+class VerifiedTokenCache:
+    """Bounded LRU of verified token digests mapped to their payloads until the token's exp."""
+
+    def __init__(self, max_size: int = VERIFIED_TOKEN_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _digest(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get(self, token: str):
+        """Returns the cached payload for a still valid token, or None."""
+        digest = self._digest(token)
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is not None:
+                payload, exp = entry
+                if exp > time.time():
+                    self._entries.move_to_end(digest)
+                    self.hits += 1
+                    return payload
+                del self._entries[digest]
+            self.misses += 1
+            return None
+
+    def put(self, token: str, payload: dict) -> None:
+        # Tokens without an exp are never cached since they cannot be invalidated
+        exp = payload.get("exp")
+        if not exp:
+            return
+        digest = self._digest(token)
+        with self._lock:
+            self._entries[digest] = (payload, exp)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+        }
+
+
+token_cache = VerifiedTokenCache()
+
+
+def check_token_expiry(token):
+    """Rejects expired tokens before any key lookup"""
+    unverified_payload = jwt.get_unverified_claims(token)
+    exp_timestamp = unverified_payload.get("exp")
+    if exp_timestamp:
+        exp_time = datetime.fromtimestamp(exp_timestamp)
+        now = datetime.now()
+        if exp_time < now:
+            logger.warning(f"Token expired at {exp_time}")
+            raise ExpiredSignatureError("Token has expired")
+
+
+def decode_token(token, key):
+    """Verifies the token signature and claims against the given key"""
+    options = {"verify_aud": False}
+
+    payload = jwt.decode(
+        token,
+        key,
+        algorithms=["RS256"],
+        issuer=os.getenv("CLERK_ISSUER"),
+        options=options,
+    )
+
+    logger.info("Token verified successfully")
+    return payload
+
+
+async def verify_token_async(token):
+    """Verify the JWT token from Clerk without blocking the event loop"""
     try:
-        logger.info(f"Fetching JWKS from {clerk_issuer}")
-        response = session.get(
-            f"{clerk_issuer}/.well-known/jwks.json",
-            timeout=10,
-            headers={"Accept": "application/json"},
-        )
-        response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Failed to fetch JWKS: {str(e)}")
-        raise JWTError(f"Failed to fetch JWKS: {str(e)}")
-
-
-def verify_token(token):
-    """Verify the JWT token from Clerk"""
-    try:
-        # First decode without verification to check expiry
-        unverified_payload = jwt.decode(
-            token, None, options={"verify_signature": False}
-        )
-        exp_timestamp = unverified_payload.get("exp")
-        if exp_timestamp:
-            exp_time = datetime.fromtimestamp(exp_timestamp)
-            now = datetime.now()
-            if exp_time < now:
-                logger.warning(f"Token expired at {exp_time}")
-                raise ExpiredSignatureError("Token has expired")
-
-        # Get the JWKS
-        jwks = get_jwks()
+        check_token_expiry(token)
+
         unverified_headers = jwt.get_unverified_headers(token)
         logger.debug(f"Token headers: {unverified_headers}")
 
-        # Find the key that matches the token's key ID
-        rsa_key = {}
-        for key in jwks["keys"]:
-            if key["kid"] == unverified_headers["kid"]:
-                rsa_key = {
-                    "kty": key["kty"],
-                    "kid": key["kid"],
-                    "n": key["n"],
-                    "e": key["e"],
-                }
-                break
-
-        if not rsa_key:
+        # Pre-built key objects skip re-parsing the JWK on every request
+        key = await jwks_cache.get_prepared_key(unverified_headers["kid"])
+        if key is None:
             logger.error("No matching key found in JWKS")
             raise JWTError("No matching key found")
 
-        # Verify the token
-        options = {"verify_aud": False}
-
-        payload = jwt.decode(
-            token,
-            rsa_key,
-            algorithms=["RS256"],
-            issuer=os.getenv("CLERK_ISSUER"),
-            options=options,
-        )
-
-        logger.info("Token verified successfully")
-        return payload
+        return decode_token(token, key)
     except ExpiredSignatureError:
         logger.warning("Token has expired")
         raise
@@ -124,7 +284,10 @@ def requires_auth(func):
         try:
             token = auth_header.split(" ")[1]
             try:
-                payload = verify_token(token)
+                payload = token_cache.get(token)
+                if payload is None:
+                    payload = await verify_token_async(token)
+                    token_cache.put(token, payload)
                 request.state.user = payload
                 return await func(*args, **kwargs)
             except ExpiredSignatureError:
@@ -146,6 +309,9 @@ def requires_auth(func):
                     },
                 )
 
+        except HTTPException:
+            # Auth failures above and errors raised by the route itself
+            raise
         except Exception as e:
             logger.error(f"Auth error: {str(e)}")
             raise HTTPException(
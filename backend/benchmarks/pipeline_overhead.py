@@ -0,0 +1,219 @@
+"""Compares rent agreement generation with and without the ReAct agent hop.
+
+Both modes run the real generator from services.doc_agent against a fake chat
+model that charges a fixed latency per call plus time per prompt and output
+token, so the difference is the agent's own LLM calls. PDF rendering is
+skipped since it is the same in both modes. Tokens are counted with tiktoken
+when it is installed and estimated at four characters per token otherwise.
+
+Run from the backend directory:
+
+    python -m benchmarks.pipeline_overhead
+    python -m benchmarks.pipeline_overhead --runs 10 --call-latency 0.8
+"""
+
+import argparse
+import asyncio
+import os
+import time
+from datetime import datetime
+from typing import Any, List, Optional
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+import helpers.rent_agreement_generator as rent_agreement_generator
+import services.doc_agent as doc_agent
+from helpers.state_manager import state_manager
+from models.rental_agreement import AgreementRequest
+from templates import format_agreement_details
+
+try:
+    import tiktoken
+
+    encoding = tiktoken.get_encoding("cl100k_base")
+
+    def count_tokens(text: str) -> int:
+        return len(encoding.encode(text))
+
+except ImportError:
+
+    def count_tokens(text: str) -> int:
+        return max(1, len(text) // 4)
+
+
+AGREEMENT_BODY = (
+    "## RENTAL AGREEMENT\n\n"
+    + "The Tenant shall pay the agreed monthly rent on or before the fifth day "
+    "of every month and keep the premises in good repair. " * 60
+)
+
+REQUEST = AgreementRequest(
+    owner_name="Asha Kulkarni",
+    owner_email="owner@example.com",
+    tenant_details=[
+        {"name": "Rahul Mehta", "email": "tenant@example.com", "address": "12, MG Road, Pune"}
+    ],
+    property_address="Flat 402, Green Park, Baner",
+    city="Pune",
+    rent_amount=25000,
+    agreement_period=[datetime(2025, 1, 1), datetime(2025, 11, 30)],
+    owner_address="7, Residency Road, Pune",
+    furnishing_type="Semi-Furnished",
+    security_deposit=75000,
+    bhk_type="2BHK",
+    area=950,
+    registration_date="2025-01-01",
+    furniture_and_appliances=[{"sr_no": "1", "name": "Bed", "units": "2"}],
+    amenities=["Lift", "Parking"],
+    user_id="benchmark",
+)
+
+
+class FakeChatModel(BaseChatModel):
+    """Answers the agent and the graph like the real model would, with injected latency."""
+
+    call_latency: float = 0.5
+    seconds_per_prompt_token: float = 0.0002
+    seconds_per_output_token: float = 0.01
+    action_input: str = ""
+    calls: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _answer(self, prompt: str) -> str:
+        if "I now need to return a final answer" in prompt:
+            # The agent's early stop asks for one more completion over the tool output
+            return f"Final Answer: {AGREEMENT_BODY}"
+        if "Action: generate_agreement" in prompt:
+            return (
+                "Thought: Do I need to use a tool? Yes\n"
+                "Action: generate_agreement\n"
+                f"Action Input: {self.action_input}"
+            )
+        return AGREEMENT_BODY
+
+    def _complete(self, messages: List[BaseMessage]):
+        prompt = "\n".join(str(message.content) for message in messages)
+        answer = self._answer(prompt)
+        prompt_tokens = count_tokens(prompt)
+        completion_tokens = count_tokens(answer)
+        self.calls += 1
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        latency = (
+            self.call_latency
+            + prompt_tokens * self.seconds_per_prompt_token
+            + completion_tokens * self.seconds_per_output_token
+        )
+        return answer, latency
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        answer, latency = self._complete(messages)
+        time.sleep(latency)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=answer))])
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        answer, latency = self._complete(messages)
+        await asyncio.sleep(latency)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=answer))])
+
+
+async def run(mode: str, runs: int, llm: FakeChatModel) -> dict:
+    doc_agent.GENERATION_PIPELINE = mode
+    agreement_details = format_agreement_details(
+        owner_name=REQUEST.owner_name,
+        tenant_details=REQUEST.tenant_details,
+        property_address=REQUEST.property_address,
+        city=REQUEST.city,
+        rent_amount=REQUEST.rent_amount,
+        agreement_period=[date.isoformat() for date in REQUEST.agreement_period],
+        owner_address=REQUEST.owner_address,
+        furnishing_type=REQUEST.furnishing_type,
+        security_deposit=REQUEST.security_deposit,
+        bhk_type=REQUEST.bhk_type,
+        area=REQUEST.area,
+        registration_date=REQUEST.registration_date,
+        amenities=REQUEST.amenities,
+    )
+    llm.action_input = agreement_details
+    llm.calls = llm.prompt_tokens = llm.completion_tokens = 0
+
+    elapsed = 0.0
+    for agreement_id in range(runs):
+        state = state_manager.get_agreement_state(agreement_id)
+        state.set_owner(REQUEST.owner_name, REQUEST.owner_email)
+        state.set_agreement_details(REQUEST)
+        for tenant in REQUEST.tenant_details:
+            state.add_tenant(tenant["email"], tenant["name"], tenant["address"])
+
+        generate = doc_agent.create_agreement_generator(agreement_id)
+        started = time.perf_counter()
+        await generate(agreement_details)
+        elapsed += time.perf_counter() - started
+        # create_pdf still opens its temp file even with rendering skipped
+        if state.pdf_file_path and os.path.exists(state.pdf_file_path):
+            os.remove(state.pdf_file_path)
+        state_manager._agreement_states.pop(agreement_id, None)
+
+    return {
+        "seconds": elapsed / runs,
+        "calls": llm.calls / runs,
+        "prompt_tokens": llm.prompt_tokens / runs,
+        "completion_tokens": llm.completion_tokens / runs,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--call-latency", type=float, default=0.5)
+    parser.add_argument("--seconds-per-prompt-token", type=float, default=0.0002)
+    parser.add_argument("--seconds-per-output-token", type=float, default=0.01)
+    args = parser.parse_args()
+
+    llm = FakeChatModel(
+        call_latency=args.call_latency,
+        seconds_per_prompt_token=args.seconds_per_prompt_token,
+        seconds_per_output_token=args.seconds_per_output_token,
+    )
+    # The graph and the agent both read the module-level model at call time
+    rent_agreement_generator.llm = llm
+    doc_agent.llm = llm
+    rent_agreement_generator.create_pdf_file = lambda *args, **kwargs: None
+
+    results = {
+        mode: asyncio.run(run(mode, args.runs, llm)) for mode in ("agent", "direct")
+    }
+
+    print(f"{'mode':<8}{'seconds':>10}{'LLM calls':>11}{'prompt tok':>12}{'output tok':>12}")
+    for mode, result in results.items():
+        print(
+            f"{mode:<8}{result['seconds']:>10.2f}{result['calls']:>11.1f}"
+            f"{result['prompt_tokens']:>12.0f}{result['completion_tokens']:>12.0f}"
+        )
+    agent, direct = results["agent"], results["direct"]
+    print(
+        f"direct saves {agent['seconds'] - direct['seconds']:.2f}s and "
+        f"{agent['prompt_tokens'] + agent['completion_tokens'] - direct['prompt_tokens'] - direct['completion_tokens']:.0f} "
+        "tokens per agreement"
+    )
+
+
+if __name__ == "__main__":
+    main()
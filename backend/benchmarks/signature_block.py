@@ -0,0 +1,110 @@
+"""Compares the LLM signature pass with the locally written signature block.
+
+Runs the template generator's generate node end to end on multi-page template
+PDFs in both SIGNATURE_BLOCK modes, against the fake chat model from
+benchmarks.template_chunks extended to answer the signature prompts. The "llm"
+mode sends the whole filled agreement back through add_signature, while the
+"local" mode asks only for the role names alongside the chunk filling.
+
+Run from the backend directory:
+
+    python -m benchmarks.signature_block
+    python -m benchmarks.signature_block --pages 5 20 --call-latency 0.8
+"""
+
+import argparse
+import asyncio
+import json
+import tempfile
+import time
+from langchain_core.messages import HumanMessage
+import helpers.template_based_agreement_generator as template_generator
+from helpers.state_manager import state_manager
+from benchmarks.template_chunks import FakeChatModel, USER_PROMPT, write_template
+
+ROLES = {
+    "authority_role": "Authority",
+    "authority_name": "Greenfield Infra Pvt Ltd",
+    "participant_role": "Participant",
+    "participant_name": "Asha Kulkarni",
+}
+
+
+class SignatureChatModel(FakeChatModel):
+    """Also answers the add_signature and role name prompts."""
+
+    output_tokens: int = 0
+
+    @staticmethod
+    def echo(prompt: str) -> str:
+        if "SIGNATURE REPLACEMENT RULES" in prompt:
+            agreement_text = prompt.split("intent:", 1)[1].split("## SIGNATURE REPLACEMENT RULES", 1)[0]
+            return template_generator.insert_signature_block(agreement_text.strip(), ROLES)
+        if '"authority_role"' in prompt:
+            return json.dumps(ROLES)
+        return FakeChatModel.echo(prompt)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        result = await super()._agenerate(messages, stop, run_manager, **kwargs)
+        self.output_tokens += len(result.generations[0].message.content) // 4
+        return result
+
+
+async def run(mode: str, template_path: str, runs: int, llm: SignatureChatModel) -> dict:
+    template_generator.SIGNATURE_BLOCK = mode
+    llm.calls = llm.output_tokens = 0
+    elapsed = 0.0
+    for agreement_id in range(runs):
+        state = state_manager.get_template_agreement_state(agreement_id)
+        state.template_file_path = template_path
+        started = time.perf_counter()
+        await template_generator.generate_agreement(
+            {"messages": [HumanMessage(content=USER_PROMPT)], "agreement_id": agreement_id}
+        )
+        elapsed += time.perf_counter() - started
+        if "[PARTICIPANT_SIGNATURE]" not in state.agreement_text:
+            raise AssertionError(f"{mode} mode left out the signature placeholders")
+        await state_manager.cleanup_template_agreement_state(agreement_id)
+    return {
+        "seconds": elapsed / runs,
+        "calls": llm.calls / runs,
+        "output_tokens": llm.output_tokens / runs,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, nargs="+", default=[5, 20])
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--call-latency", type=float, default=0.8)
+    parser.add_argument("--seconds-per-output-token", type=float, default=0.005)
+    args = parser.parse_args()
+
+    llm = SignatureChatModel(
+        call_latency=args.call_latency,
+        seconds_per_output_token=args.seconds_per_output_token,
+    )
+    template_generator.llm = llm
+
+    print(f"{'pages':>6}{'mode':>7}{'seconds':>10}{'LLM calls':>11}{'output tok':>12}")
+    with tempfile.TemporaryDirectory() as directory:
+        for pages in args.pages:
+            template_path = write_template(pages, 1.0, directory)
+            results = {
+                mode: asyncio.run(run(mode, template_path, args.runs, llm))
+                for mode in ("llm", "local")
+            }
+            for mode, result in results.items():
+                print(
+                    f"{pages:>6}{mode:>7}{result['seconds']:>10.2f}{result['calls']:>11.1f}"
+                    f"{result['output_tokens']:>12.0f}"
+                )
+            print(
+                f"{pages:>6} local saves {results['llm']['seconds'] - results['local']['seconds']:.2f}s "
+                f"and {results['llm']['output_tokens'] - results['local']['output_tokens']:.0f} "
+                "output tokens per agreement"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""Measures the memory held per pending rent agreement.
+
+Builds N agreements waiting for approval, the way create_agreement_details
+leaves them, and reports the bytes tracemalloc attributes to each one. The
+previous dict-per-field layout is measured alongside for comparison.
+
+Run from the backend directory:
+
+    python -m benchmarks.state_memory
+    python -m benchmarks.state_memory --counts 10000 --layouts current
+"""
+
+import argparse
+import gc
+import random
+import tracemalloc
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from helpers.state_manager import StateManager
+
+CITIES = ["Pune", "Mumbai", "Bengaluru", "Hyderabad", "Chennai", "Delhi"]
+AMENITIES = ["Lift", "Parking", "Power Backup", "Security", "Gym", "Club House"]
+FURNITURE = ["Bed", "Sofa", "Fan", "Wardrobe", "Refrigerator", "Dining Table"]
+CLAUSE = (
+    "## {number}. {title}\n"
+    "The Tenant {tenant} shall pay the monthly rent of Rs. {rent} to the Owner "
+    "{owner} on or before the 5th day of every month for the premises at "
+    "{address}, {city}. Any delay beyond the due date attracts the charges "
+    "agreed herein, and the Owner may issue a written notice of {days} days.\n\n"
+)
+
+
+@dataclass
+class LegacyAgreementState:
+    """The layout AgreementState had before tenants became Party records."""
+
+    owner_id: str = field(default_factory=lambda: str(uuid.uuid4()))
+    owner_name: str = ""
+    owner_email: str = ""
+    tenant_emails: Dict[str, Optional[str]] = field(default_factory=dict)
+    tenants: Dict[str, bool] = field(default_factory=dict)
+    tenant_names: Dict[str, str] = field(default_factory=dict)
+    owner_approved: bool = False
+    agreement_text: str = ""
+    owner_signature: str = ""
+    tenant_signatures: Dict[str, Optional[str]] = field(default_factory=dict)
+    owner_photo: str = ""
+    tenant_photos: Dict[str, Optional[str]] = field(default_factory=dict)
+    pdf_file_path: str = ""
+    is_pdf_generated: bool = False
+    agreement_id: Optional[int] = None
+    property_address: str = ""
+    city: str = ""
+    rent_amount: int = 0
+    agreement_period: List[datetime] = field(default_factory=list)
+    owner_address: str = ""
+    tenant_details: list = field(default_factory=list)
+    furnishing_type: str = ""
+    security_deposit: int = 0
+    bhk_type: str = ""
+    area: int = 0
+    registration_date: str = ""
+    furniture_and_appliances: List[Dict[str, str]] = field(default_factory=list)
+    amenities: List[str] = field(default_factory=list)
+    user_id: str = ""
+
+
+def fresh(value: str) -> str:
+    # Request parsing hands every agreement its own string objects
+    return "".join(list(value))
+
+
+def agreement_text(rng: random.Random, details: dict, text_bytes: int) -> str:
+    clauses = []
+    size = 0
+    number = 1
+    while size < text_bytes:
+        clause = CLAUSE.format(
+            number=number,
+            title=f"Clause {number}",
+            tenant=details["tenants"][0]["name"],
+            rent=details["rent_amount"],
+            owner=details["owner_name"],
+            address=details["property_address"],
+            city=details["city"],
+            days=rng.randint(15, 90),
+        )
+        clauses.append(clause)
+        size += len(clause)
+        number += 1
+    return "".join(clauses)
+
+
+def agreement_details(rng: random.Random, agreement_id: int) -> dict:
+    start = datetime(2025, 1, 1) + timedelta(days=rng.randint(0, 365))
+    return {
+        "owner_name": f"Owner {agreement_id}",
+        "owner_email": f"owner{agreement_id}@example.com",
+        "owner_address": f"{rng.randint(1, 999)}, Residency Road, {rng.choice(CITIES)}",
+        "tenants": [
+            {
+                "name": f"Tenant {agreement_id}-{i}",
+                "email": f"tenant{agreement_id}-{i}@example.com",
+                "address": f"{rng.randint(1, 999)}, MG Road, {rng.choice(CITIES)}",
+            }
+            for i in range(rng.randint(1, 3))
+        ],
+        "property_address": f"Flat {rng.randint(1, 999)}, Green Park",
+        "city": fresh(rng.choice(CITIES)),
+        "rent_amount": rng.randint(10, 90) * 1000,
+        "agreement_period": [start, start + timedelta(days=330)],
+        "furnishing_type": fresh(rng.choice(["Furnished", "Semi-Furnished"])),
+        "security_deposit": rng.randint(1, 6) * 10000,
+        "bhk_type": fresh(rng.choice(["1BHK", "2BHK", "3BHK"])),
+        "area": rng.randint(400, 2000),
+        "registration_date": start.date().isoformat(),
+        "furniture_and_appliances": [
+            {"sr_no": fresh(str(i + 1)), "name": fresh(name), "units": fresh("1")}
+            for i, name in enumerate(rng.sample(FURNITURE, 4))
+        ],
+        "amenities": [fresh(amenity) for amenity in rng.sample(AMENITIES, 3)],
+        "user_id": fresh(f"user_{rng.randint(1, 500)}"),
+    }
+
+
+def build_current(manager: StateManager, agreement_id: int, details: dict, text: str):
+    state = manager.get_agreement_state(agreement_id)
+    state.set_owner(details["owner_name"], details["owner_email"])
+    for name, value in details.items():
+        if name not in ("owner_name", "owner_email", "tenants"):
+            setattr(state, name, value)
+    state._intern_details()
+    for tenant in details["tenants"]:
+        state.add_tenant(tenant["email"], tenant["name"], tenant["address"])
+    state.agreement_text = text
+    state.is_pdf_generated = True
+    return state
+
+
+def build_legacy(states: dict, agreement_id: int, details: dict, text: str):
+    state = LegacyAgreementState(agreement_id=agreement_id)
+    state.owner_name = details["owner_name"]
+    state.owner_email = details["owner_email"]
+    for name, value in details.items():
+        if name not in ("owner_name", "owner_email", "tenants"):
+            setattr(state, name, value)
+    state.tenant_details = details["tenants"]
+    for tenant in details["tenants"]:
+        tenant_id = str(uuid.uuid4())
+        state.tenants[tenant_id] = False
+        state.tenant_names[tenant_id] = tenant["name"]
+        state.tenant_emails[tenant_id] = tenant["email"]
+    state.agreement_text = text
+    state.is_pdf_generated = True
+    states[agreement_id] = state
+    return state
+
+
+def measure(layout: str, count: int, text_bytes: int, seed: int) -> float:
+    rng = random.Random(seed)
+    gc.collect()
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    # Inputs are traced too, since a state keeps whatever parts of the request it
+    # references; once they are dropped only what the states retain is left
+    inputs = []
+    for agreement_id in range(count):
+        details = agreement_details(rng, agreement_id)
+        inputs.append((details, agreement_text(rng, details, text_bytes)))
+
+    if layout == "current":
+        holder = StateManager()
+        for agreement_id, (details, text) in enumerate(inputs):
+            build_current(holder, agreement_id, details, text)
+    else:
+        holder = {}
+        for agreement_id, (details, text) in enumerate(inputs):
+            build_legacy(holder, agreement_id, details, text)
+    del inputs, details, text
+    gc.collect()
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del holder
+    gc.collect()
+    return (after - before) / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--counts", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument(
+        "--layouts", nargs="+", choices=["current", "legacy"], default=["legacy", "current"]
+    )
+    parser.add_argument(
+        "--text-bytes", type=int, default=8000, help="size of each agreement text"
+    )
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    print(f"{'layout':<10}{'states':>10}{'bytes/agreement':>18}")
+    for count in args.counts:
+        for layout in args.layouts:
+            per_agreement = measure(layout, count, args.text_bytes, args.seed)
+            print(f"{layout:<10}{count:>10}{per_agreement:>18,.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""Measures template filling time with chunks sent serially and concurrently.
+
+Builds multi-page template PDFs, chunks them with extract_text_from_pdf like
+the template generator does, and fills them with fill_chunks against a fake
+chat model that echoes each chunk back after a latency per call and per output
+token. A failure rate can be injected to show chunks retried on their own,
+and --fillable-share leaves placeholders on only part of the pages to show
+the chunks with nothing to fill skipping the model.
+
+Run from the backend directory:
+
+    python -m benchmarks.template_chunks
+    python -m benchmarks.template_chunks --pages 5 20 50 --concurrency 1 4 8 --failure-rate 0.05
+    python -m benchmarks.template_chunks --pages 50 --concurrency 4 --fillable-share 0.1
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+from typing import Any, List, Optional
+import fitz
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+import helpers.template_based_agreement_generator as template_generator
+from helpers.agreement_generator_helper import extract_text_from_pdf
+
+CLAUSE = (
+    "{number}. The Participant ____________ agrees to deliver the services "
+    "described in Schedule {number} to the Authority [AUTHORITY NAME] from "
+    "the date of ___/___/20__ and shall be paid Rs. ________ within thirty "
+    "days of each invoice raised under this clause.\n\n"
+)
+STATIC_CLAUSE = (
+    "{number}. The Participant agrees to deliver the services described in "
+    "Schedule {number} to the Authority and shall be paid within thirty days "
+    "of each invoice raised under this clause, subject to the terms herein.\n\n"
+)
+CLAUSES_PER_PAGE = 8
+USER_PROMPT = (
+    "Fill this services agreement between Greenfield Infra Pvt Ltd and Asha "
+    "Kulkarni starting 1 January 2025 for Rs. 45000 a month."
+)
+
+
+class FakeChatModel(BaseChatModel):
+    """Echoes the template chunk it was asked to fill, with injected latency and failures."""
+
+    call_latency: float = 0.8
+    seconds_per_output_token: float = 0.005
+    failure_rate: float = 0.0
+    seed: int = 7
+    calls: int = 0
+    failures: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    @staticmethod
+    def echo(prompt: str) -> str:
+        if "intent:" not in prompt:
+            return prompt
+        return prompt.split("intent:", 1)[1].split("\n    ---", 1)[0].strip()
+
+    def _start_call(self, messages: List[BaseMessage]) -> tuple:
+        """Counts the call and returns its answer, latency and whether it is injected to fail."""
+        self.calls += 1
+        answer = self.echo(str(messages[0].content))
+        failed = random.Random(self.seed * 100_003 + self.calls).random() < self.failure_rate
+        latency = self.call_latency + len(answer) / 4 * self.seconds_per_output_token
+        return answer, latency, failed
+
+    def _finish_call(self, answer: str, failed: bool) -> ChatResult:
+        if failed:
+            self.failures += 1
+            raise ConnectionError("injected model failure")
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=answer))])
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        answer, latency, failed = self._start_call(messages)
+        time.sleep(latency)
+        return self._finish_call(answer, failed)
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        answer, latency, failed = self._start_call(messages)
+        await asyncio.sleep(latency)
+        return self._finish_call(answer, failed)
+
+
+def write_template(pages: int, fillable_share: float, directory: str) -> str:
+    doc = fitz.open()
+    number = 1
+    fillable_pages = max(1, round(pages * fillable_share))
+    for page_number in range(pages):
+        page = doc.new_page()
+        # Fillable pages are spread out the way parties and dates usually are
+        clause = CLAUSE if page_number * fillable_pages % pages < fillable_pages else STATIC_CLAUSE
+        text = ""
+        for _ in range(CLAUSES_PER_PAGE):
+            text += clause.format(number=number)
+            number += 1
+        page.insert_textbox(fitz.Rect(50, 50, 545, 790), text, fontsize=10)
+    path = os.path.join(directory, f"template_{pages}_pages_{fillable_pages}_fillable.pdf")
+    doc.save(path)
+    doc.close()
+    return path
+
+
+async def measure(chunks: List[str], concurrency: int, llm: FakeChatModel) -> dict:
+    llm.calls = llm.failures = 0
+    started = time.perf_counter()
+    filled = await template_generator.fill_chunks(
+        chunks, [HumanMessage(content=USER_PROMPT)], concurrency
+    )
+    elapsed = time.perf_counter() - started
+    expected = [
+        llm.echo(template_generator.SYSTEM_PROMPT_FOR_AGGREMENT_GENERATION.format(template_text=chunk))
+        for chunk in chunks
+    ]
+    if filled != expected:
+        raise AssertionError("chunks were not reassembled in template order")
+    return {"seconds": elapsed, "calls": llm.calls, "failures": llm.failures}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, nargs="+", default=[5, 20, 50])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--call-latency", type=float, default=0.8)
+    parser.add_argument("--seconds-per-output-token", type=float, default=0.005)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument(
+        "--fillable-share", type=float, default=1.0, help="share of pages with placeholders"
+    )
+    args = parser.parse_args()
+
+    llm = FakeChatModel(
+        call_latency=args.call_latency,
+        seconds_per_output_token=args.seconds_per_output_token,
+        failure_rate=args.failure_rate,
+    )
+    template_generator.llm = llm
+    # Keeps the retry delay from dominating the comparison
+    template_generator.fill_chunk.retry.wait = template_generator.wait_fixed(0)
+
+    print(f"{'pages':>6}{'chunks':>8}{'concurrency':>13}{'seconds':>10}{'calls':>7}{'failures':>10}")
+    with tempfile.TemporaryDirectory() as directory:
+        for pages in args.pages:
+            chunks = extract_text_from_pdf(
+                write_template(pages, args.fillable_share, directory)
+            )
+            serial = None
+            for concurrency in args.concurrency:
+                result = asyncio.run(measure(chunks, concurrency, llm))
+                serial = serial or result["seconds"]
+                print(
+                    f"{pages:>6}{len(chunks):>8}{concurrency:>13}{result['seconds']:>10.2f}"
+                    f"{result['calls']:>7}{result['failures']:>10}"
+                    f"  ({serial / result['seconds']:.1f}x)"
+                )
+
+
+if __name__ == "__main__":
+    main()
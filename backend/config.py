@@ -7,7 +7,51 @@ load_dotenv()
 # Configuration
 SMTP2GO_API_KEY = os.getenv("SMTP2GO_API_KEY")
 SENDER_EMAIL = os.getenv("SENDER_EMAIL")
-WEBSOCKET_URL = os.getenv("WEBSOCKET_URL")
 BASE_APPROVAL_URL = os.getenv("BASE_APPROVAL_URL")
 CORS_ALLOWED_ORIGIN = os.getenv("CORS_ALLOWED_ORIGIN")
 CONTACT_MAIL = os.getenv("CONTACT_MAIL")
+DATABASE_URL = os.getenv("DATABASE_URL")
+# Pub/sub used to share events between workers: "postgres" or "memory"
+EVENT_BACKPLANE = os.getenv("EVENT_BACKPLANE", "memory")
+# Where agreement states are kept between requests: "postgres" or "memory"
+STATE_STORE = os.getenv("STATE_STORE", "memory")
+# How agreements are generated: "direct" runs the LangGraph pipeline on the
+# request, "agent" lets a ReAct agent decide to call it first
+GENERATION_PIPELINE = os.getenv("GENERATION_PIPELINE", "direct")
+# How template agreements get their signature section: "local" writes the
+# placeholder block itself and asks the LLM only for the role names, "llm"
+# sends the whole agreement back to the LLM to rewrite it
+SIGNATURE_BLOCK = os.getenv("SIGNATURE_BLOCK", "local")
+
+# Tunables below are read here rather than in constants.py so that .env has
+# been loaded first
+
+# Seconds between server pings on /ws
+WEBSOCKET_PING_INTERVAL_SECONDS = int(os.getenv("WEBSOCKET_PING_INTERVAL_SECONDS", "20"))
+# Connections with no inbound traffic (including pongs) for this long are closed
+WEBSOCKET_IDLE_TIMEOUT_SECONDS = int(os.getenv("WEBSOCKET_IDLE_TIMEOUT_SECONDS", "60"))
+# Concurrent /ws connections allowed per signed-in user, or per client address
+# for anonymous connections when WEBSOCKET_TRUST_FORWARDED_FOR is set
+WEBSOCKET_MAX_CONNECTIONS_PER_USER = int(os.getenv("WEBSOCKET_MAX_CONNECTIONS_PER_USER", "5"))
+# Seconds a /ws client has to send its auth message after connecting
+WEBSOCKET_AUTH_TIMEOUT_SECONDS = int(os.getenv("WEBSOCKET_AUTH_TIMEOUT_SECONDS", "10"))
+# Set only behind a proxy that appends the client address to X-Forwarded-For;
+# otherwise every client behind the proxy or a shared NAT would share one cap,
+# so anonymous connections are not capped at all
+WEBSOCKET_TRUST_FORWARDED_FOR = os.getenv("WEBSOCKET_TRUST_FORWARDED_FOR", "false").lower() == "true"
+
+# Agreement jobs a single worker process runs at once, most of them waiting on approvals
+JOB_WORKER_CONCURRENCY = int(os.getenv("JOB_WORKER_CONCURRENCY", "100"))
+# LLM generations a single worker process runs at once
+GENERATION_CONCURRENCY = int(os.getenv("GENERATION_CONCURRENCY", "4"))
+# Open connections to the model server shared by all generations on a worker
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+# Token budget of each template chunk sent to the LLM, on top of the system prompt
+TEMPLATE_CHUNK_TOKENS = int(os.getenv("TEMPLATE_CHUNK_TOKENS", "1500"))
+# Template chunks of one agreement sent to the LLM at once
+TEMPLATE_CHUNK_CONCURRENCY = int(os.getenv("TEMPLATE_CHUNK_CONCURRENCY", "4"))
+# Queued jobs beyond which new agreements are rejected with 503
+MAX_QUEUED_GENERATIONS = int(os.getenv("MAX_QUEUED_GENERATIONS", "50"))
+# Agreement states and temp files unused for this long are treated as abandoned.
+# Must outlast a generation plus the 500 second approval window.
+STATE_TTL_SECONDS = int(os.getenv("STATE_TTL_SECONDS", "3600"))
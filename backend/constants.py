@@ -10,6 +10,44 @@ CHAT_OPENAI_BASE_URL = "http://0.0.0.0:1337/v1"
 # SMTP2GO email API endpoint
 SMTP2GO_EMAIL_SEND_URL = "https://api.smtp2go.com/v3/email/send"
 
+# How long the Clerk JWKS is cached before it is fetched again
+JWKS_CACHE_TTL_SECONDS = 3600
+# Minimum gap between JWKS refetches triggered by an unknown kid
+JWKS_MIN_REFRESH_SECONDS = 30
+# How long stale JWKS keys are served after a failed refetch before retrying
+JWKS_FAILURE_BACKOFF_SECONDS = 30
+# Maximum number of verified bearer tokens kept in memory
+VERIFIED_TOKEN_CACHE_SIZE = 10000
+
+# Outbound messages buffered per WebSocket before the client is dropped as too slow
+WEBSOCKET_SEND_QUEUE_SIZE = 100
+# Recent events kept per agreement channel for clients that reconnect
+WEBSOCKET_REPLAY_BUFFER_SIZE = 50
+# Agreement channels whose history is kept, least recently used are evicted first
+WEBSOCKET_REPLAY_MAX_CHANNELS = 10000
+
+# Characters from each end of the template shown to the LLM to name the signing parties
+SIGNATURE_ROLES_CONTEXT_CHARS = 2000
+# Attempts per template chunk before the whole generation fails
+CHUNK_MAX_RETRIES = 3
+CHUNK_RETRY_DELAY = 1
+# Generation time assumed for Retry-After before any generation has finished
+DEFAULT_GENERATION_SECONDS = 60
+# Seconds an idle worker waits before polling the job table again
+JOB_POLL_INTERVAL_SECONDS = 5
+# A running job is reclaimed by another worker once its lease is this old
+JOB_LEASE_SECONDS = 60
+JOB_HEARTBEAT_INTERVAL_SECONDS = 20
+# Claims of the same job (first run plus restarts from scratch) before it is failed
+JOB_MAX_ATTEMPTS = 3
+# Highest priority a caller may request for a job, 0 being the default
+MAX_JOB_PRIORITY = 10
+
+# Seconds between sweeps for abandoned states and temp files
+STATE_SWEEP_INTERVAL_SECONDS = 60
+# Uploaded photos and signatures
+UPLOAD_DIR = "./utils"
+
 MAX_RETRIES = 5
 RETRY_DELAY = 2
 
@@ -1,4 +1,5 @@
 import fitz
+import math
 import os
 import re
 from collections import Counter
@@ -11,8 +12,39 @@ from reportlab.pdfbase.ttfonts import TTFont
 from reportlab.pdfbase import pdfmetrics
 from typing import List, Tuple, Optional, Dict, Union
 from reportlab.lib.colors import Color
+from config import TEMPLATE_CHUNK_TOKENS
 
 PAGE_WIDTH, PAGE_HEIGHT = A4
+# Rough size of a token in English template text, close enough for budgeting chunks
+CHARS_PER_TOKEN = 4
+# A paragraph ending in anything else runs on into the next one
+CLAUSE_ENDINGS = (".", ":", ";", "!", "?")
+# Fields a template leaves for the LLM to fill
+PLACEHOLDER_PATTERN = re.compile(
+    r"_{3,}"  # blanks, including __/__/____ dates
+    r"|\.{4,}|…{2,}"  # dotted leaders
+    r"|<<[^<>\n]{1,60}>>|<[A-Za-z][\w .-]{0,40}>"  # <<name>> and <name>
+    r"|\[[^\[\]\n]{1,60}\]|\{\{?[^{}\n]{1,60}\}?\}"  # [NAME] and {name}
+    r"|\b(?:DD|MM|YY|YYYY)(?:\s?[/.-]\s?(?:DD|MM|YY|YYYY)){1,2}\b"  # DD/MM/YYYY
+    r"|\b(?:19|20)_{1,2}(?!\w)",  # 20__
+    re.IGNORECASE,
+)
+# Lines that make up the parties' signature section: signature and sign-here
+# lines, and placeholders from an earlier pass
+SIGNATURE_LINE_PATTERN = re.compile(
+    r"\bsign(?:ed|ature|atures|atory)?\b|\[(?:AUTHORITY|PARTICIPANT)_SIGNATURE\]", re.IGNORECASE
+)
+# Blanks to sign or write on, which may run across a long line
+SIGNATURE_BLANK_PATTERN = re.compile(r"_{3,}|\.{4,}")
+# Labels that sit between the signature lines, such as the signatory's name
+SIGNATURE_FIELD_PATTERN = re.compile(
+    r"^(?:name|date|place|designation|title|for and on behalf of)\b", re.IGNORECASE
+)
+# Witness attestations are kept as they are
+WITNESS_LINE_PATTERN = re.compile(r"\bwitness(?:es)?\b", re.IGNORECASE)
+# Text without placeholders shorter than this stays in its neighbours' chunk,
+# since a separate LLM call would cost more than echoing it back
+PASSTHROUGH_MIN_TOKENS = 200
 
 def add_watermark(c, doc) -> None:
     """Adds a large semi-transparent 'DRAFT' watermark at the center of each page."""
@@ -30,13 +62,165 @@ def add_watermark(c, doc) -> None:
     c.drawCentredString(0, 0, text)
     c.restoreState()
 
-def extract_text_from_pdf(pdf_path: str, chunk_size: int = 1000) -> List[str]:
-    """Extracts text from a PDF file and returns it in manageable chunks."""
+def estimate_tokens(text: str) -> int:
+    """Estimates the LLM tokens in a piece of template text."""
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+def has_placeholders(text: str) -> bool:
+    """Tells whether a piece of template text has any field left to fill."""
+    return PLACEHOLDER_PATTERN.search(text) is not None
+
+def is_heading(paragraph: str) -> bool:
+    """Treats a short single line without closing punctuation as a heading."""
+    return "\n" not in paragraph and len(paragraph) <= 80 and not paragraph.endswith(CLAUSE_ENDINGS)
+
+def extract_paragraphs(pdf_path: str) -> List[str]:
+    """Reads the text blocks of a PDF in page order, rejoining clauses split by a page break."""
     doc = fitz.open(pdf_path)
-    full_text = "\n".join([page.get_text("text") for page in doc])
-    chunks = [full_text[i: i + chunk_size] for i in range(0, len(full_text), chunk_size)]
+    paragraphs = []
+    for page in doc:
+        first_block = True
+        for block in page.get_text("blocks"):
+            text = block[4].strip()
+            if block[6] != 0 or not text:
+                continue
+            if first_block and paragraphs and not paragraphs[-1].endswith(CLAUSE_ENDINGS):
+                paragraphs[-1] += " " + text
+            else:
+                paragraphs.append(text)
+            first_block = False
+    return paragraphs
+
+def split_paragraph(paragraph: str, max_tokens: int) -> List[str]:
+    """Splits a paragraph over the budget at sentence ends, or between words for a single long sentence."""
+    pieces = []
+    # Each piece keeps the whitespace before it so the line breaks survive
+    for sentence in re.split(r"(?<=[.;:])(?=\s)", paragraph):
+        if estimate_tokens(sentence) <= max_tokens:
+            pieces.append(sentence)
+        else:
+            pieces.extend(re.split(r"(?=\s)", sentence))
+    return [chunk.strip() for chunk in pack(pieces, max_tokens, "")]
+
+def pack(pieces: List[str], max_tokens: int, separator: str) -> List[str]:
+    """Greedily joins consecutive pieces into chunks that stay within the token budget."""
+    chunks = []
+    current = ""
+    for piece in pieces:
+        candidate = f"{current}{separator}{piece}" if current else piece
+        if current and estimate_tokens(candidate) > max_tokens:
+            chunks.append(current)
+            current = piece
+        else:
+            current = candidate
+    if current:
+        chunks.append(current)
     return chunks
 
+def chunk_paragraphs(paragraphs: List[str], max_tokens: int) -> List[str]:
+    """Packs whole paragraphs into chunks of up to `max_tokens`, keeping headings with their clauses."""
+    units = []
+    heading = ""
+    for paragraph in paragraphs:
+        if is_heading(paragraph):
+            if heading and estimate_tokens(f"{heading}\n\n{paragraph}") > max_tokens:
+                # A long run of short lines, such as a list of blanks, is not one heading
+                units.append(heading)
+                heading = ""
+            heading = f"{heading}\n\n{paragraph}" if heading else paragraph
+            continue
+        unit = f"{heading}\n\n{paragraph}" if heading else paragraph
+        heading = ""
+        if estimate_tokens(unit) <= max_tokens:
+            units.append(unit)
+        else:
+            units.extend(split_paragraph(unit, max_tokens))
+    if heading:
+        units.append(heading)
+
+    # Runs of text with and without placeholders are packed separately so the
+    # text with nothing to fill ends up in chunks that skip the LLM
+    runs = []
+    for unit in units:
+        fillable = has_placeholders(unit)
+        if runs and runs[-1][0] == fillable:
+            runs[-1][1].append(unit)
+        else:
+            runs.append((fillable, [unit]))
+    merged = []
+    for fillable, run in runs:
+        if not fillable and estimate_tokens("\n\n".join(run)) < PASSTHROUGH_MIN_TOKENS:
+            fillable = True
+        if merged and merged[-1][0] == fillable:
+            merged[-1][1].extend(run)
+        else:
+            merged.append((fillable, run))
+    return [chunk for _, run in merged for chunk in pack(run, max_tokens, "\n\n")]
+
+def is_signature_line(line: str) -> bool:
+    """Tells whether a line belongs to a signature section, counting a sentence only if it has blanks."""
+    if WITNESS_LINE_PATTERN.search(line):
+        return False
+    if SIGNATURE_BLANK_PATTERN.search(line):
+        return True
+    # A full sentence such as "... have signed this agreement." is not a signature line
+    if len(line) > 80 or line.endswith("."):
+        return False
+    return bool(SIGNATURE_LINE_PATTERN.search(line) or SIGNATURE_FIELD_PATTERN.search(line))
+
+def find_signature_section(lines: List[str]) -> Tuple[int, int]:
+    """Returns the [start, end) lines of the parties' signature section, an empty range at the end if there is none."""
+    section = (len(lines), len(lines))
+    start = end = None
+    signed = witnessed = False
+    for index, line in enumerate(lines + [""]):
+        line = line.strip()
+        if line and is_signature_line(line):
+            if start is None:
+                start, signed = index, False
+            end = index + 1
+            signed = signed or bool(SIGNATURE_LINE_PATTERN.search(line))
+            continue
+        if line or index == len(lines):
+            # Runs of blanks or labels alone are form fields, and everything
+            # under a witnesses heading is signed by the witnesses
+            if start is not None and signed and not witnessed:
+                section = (start, end)
+            start = None
+            if WITNESS_LINE_PATTERN.search(line) and len(line) <= 80 and not line.endswith("."):
+                witnessed = True
+    return section
+
+def insert_signature_block(agreement_text: str, roles: Dict[str, str]) -> str:
+    """Replaces the signature section with the authority and participant placeholder block."""
+    lines = agreement_text.rstrip().split("\n")
+    start, end = find_signature_section(lines)
+    before = "\n".join(lines[:start]).rstrip()
+    # Annexures and witness lines after the signatures stay where they were
+    after = "\n".join(lines[end:]).strip()
+    authority_role, participant_role = roles["authority_role"], roles["participant_role"]
+    block = []
+    if roles["authority_name"] or roles["participant_name"]:
+        block += [
+            f"{authority_role}: {roles['authority_name']}",
+            f"{participant_role}: {roles['participant_name']}",
+            "",
+        ]
+    block += [
+        f"{authority_role} Signature:",
+        "[AUTHORITY_SIGNATURE]",
+        f"{participant_role} Signature:",
+        "[PARTICIPANT_SIGNATURE]",
+    ]
+    text = before + "\n\n" + "\n".join(block) + "\n"
+    if after:
+        text += "\n" + after + "\n"
+    return text
+
+def extract_text_from_pdf(pdf_path: str, max_tokens: int = TEMPLATE_CHUNK_TOKENS) -> List[str]:
+    """Extracts text from a PDF file and returns it in chunks of whole paragraphs."""
+    return chunk_paragraphs(extract_paragraphs(pdf_path), max_tokens)
+
 def find_font_file(font_name: str, fonts_dir: str = "fonts") -> Optional[str]:
     """Searches for a font file in the project-specific fonts directory."""
     font_extensions = (".ttf", ".otf")
@@ -0,0 +1,35 @@
+import asyncio
+from typing import Dict
+from helpers.backplane import backplane
+
+
+class ApprovalBus:
+    """Delivers approval events to the coroutine waiting on an agreement, on whichever worker it runs."""
+
+    def __init__(self):
+        self._queues: Dict[str, asyncio.Queue] = {}
+
+    def subscribe(self, channel: str) -> asyncio.Queue:
+        """Returns the event queue for the channel, creating it if needed."""
+        if channel not in self._queues:
+            self._queues[channel] = asyncio.Queue()
+        return self._queues[channel]
+
+    def unsubscribe(self, channel: str) -> None:
+        self._queues.pop(channel, None)
+
+    async def publish(self, channel: str, event: dict) -> None:
+        """Publishes the event to every worker through the backplane."""
+        await backplane.publish("approval", {"channel": channel, "event": event})
+
+    def deliver(self, message: dict) -> bool:
+        """Hands a backplane event to this worker's listener, returning False if it has none."""
+        queue = self._queues.get(message["channel"])
+        if queue is None:
+            return False
+        queue.put_nowait(message["event"])
+        return True
+
+
+approval_bus = ApprovalBus()
+backplane.on("approval", approval_bus.deliver)
@@ -0,0 +1,170 @@
+import asyncio
+import json
+import logging
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+from config import DATABASE_URL, EVENT_BACKPLANE
+
+logger = logging.getLogger(__name__)
+
+# Postgres rejects NOTIFY payloads of 8000 bytes or more
+MAX_NOTIFY_PAYLOAD_BYTES = 7999
+
+
+class Backplane:
+    """Pub/sub that delivers events to the handlers registered on every worker."""
+
+    def __init__(self):
+        self._handlers: Dict[str, List[Callable[[dict], None]]] = defaultdict(list)
+
+    def on(self, topic: str, handler: Callable[[dict], None]) -> None:
+        """Registers a non-blocking handler for every event published on the topic."""
+        self._handlers[topic].append(handler)
+
+    def _dispatch(self, topic: str, payload: dict) -> None:
+        for handler in self._handlers.get(topic, []):
+            try:
+                handler(payload)
+            except Exception as e:
+                logger.error(f"Backplane handler for {topic} failed: {str(e)}")
+
+    async def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+    async def publish(self, topic: str, payload: dict) -> None:
+        raise NotImplementedError
+
+    async def publish_numbered(self, topic: str, key: str, payload: dict) -> None:
+        """Publishes the event with the next "seq" number for the key, the same on every worker."""
+        raise NotImplementedError
+
+
+class InMemoryBackplane(Backplane):
+    """Delivers events within the current process only, for tests and single-worker runs."""
+
+    def __init__(self):
+        super().__init__()
+        self._sequences: Dict[str, int] = defaultdict(int)
+
+    async def publish(self, topic: str, payload: dict) -> None:
+        self._dispatch(topic, payload)
+
+    async def publish_numbered(self, topic: str, key: str, payload: dict) -> None:
+        self._sequences[key] += 1
+        self._dispatch(topic, {**payload, "seq": self._sequences[key]})
+
+
+class PostgresBackplane(Backplane):
+    """Fans events out to every worker through LISTEN/NOTIFY on the application database."""
+
+    CHANNEL = "agreement_events"
+
+    def __init__(self, dsn: str, reconnect_delay: float = 1.0):
+        super().__init__()
+        self.dsn = asyncpg_dsn(dsn)
+        self.reconnect_delay = reconnect_delay
+        self._pool = None
+        self._listen_connection = None
+        self._reconnect_task = None
+        self._closing = False
+
+    async def start(self) -> None:
+        import asyncpg
+
+        self._closing = False
+        self._pool = await asyncpg.create_pool(self.dsn, min_size=1, max_size=5)
+        await self._listen()
+
+    async def _listen(self) -> None:
+        import asyncpg
+
+        self._listen_connection = await asyncpg.connect(self.dsn)
+        self._listen_connection.add_termination_listener(self._on_connection_lost)
+        await self._listen_connection.add_listener(self.CHANNEL, self._on_notification)
+
+    def _on_notification(self, connection, pid, channel, payload: str) -> None:
+        try:
+            envelope = json.loads(payload)
+        except json.JSONDecodeError as e:
+            logger.error(f"Invalid backplane payload: {e}")
+            return
+        self._dispatch(envelope["topic"], envelope["payload"])
+
+    def _on_connection_lost(self, connection) -> None:
+        if self._closing:
+            return
+        logger.warning("Backplane listener connection lost, reconnecting")
+        self._reconnect_task = asyncio.create_task(self._reconnect())
+
+    async def _reconnect(self) -> None:
+        while not self._closing:
+            try:
+                await self._listen()
+                return
+            except Exception as e:
+                logger.error(f"Backplane reconnect failed: {str(e)}")
+                await asyncio.sleep(self.reconnect_delay)
+
+    async def stop(self) -> None:
+        self._closing = True
+        if self._reconnect_task:
+            self._reconnect_task.cancel()
+        if self._listen_connection:
+            await self._listen_connection.close()
+        if self._pool:
+            await self._pool.close()
+
+    def _envelope(self, topic: str, payload: dict) -> Optional[str]:
+        message = json.dumps({"topic": topic, "payload": payload}, default=str)
+        if len(message.encode()) > MAX_NOTIFY_PAYLOAD_BYTES:
+            logger.error(f"Backplane event on {topic} is too large to publish")
+            return None
+        return message
+
+    async def publish(self, topic: str, payload: dict) -> None:
+        # The publishing worker is also listening, so it receives its own events
+        message = self._envelope(topic, payload)
+        if message is not None:
+            await self._pool.execute("SELECT pg_notify($1, $2)", self.CHANNEL, message)
+
+    async def publish_numbered(self, topic: str, key: str, payload: dict) -> None:
+        async with self._pool.acquire() as connection:
+            # The counter row stays locked until commit, and notifications are
+            # delivered in commit order, so every worker sees a key's events in
+            # seq order. A number whose event is too large to send is skipped,
+            # which listeners see as a gap.
+            async with connection.transaction():
+                seq = await connection.fetchval(
+                    """
+                    INSERT INTO "EventSequence" ("key", "seq") VALUES ($1, 1)
+                    ON CONFLICT ("key") DO UPDATE SET "seq" = "EventSequence"."seq" + 1
+                    RETURNING "seq"
+                    """,
+                    key,
+                )
+                message = self._envelope(topic, {**payload, "seq": seq})
+                if message is not None:
+                    await connection.execute("SELECT pg_notify($1, $2)", self.CHANNEL, message)
+
+
+def asyncpg_dsn(database_url: str) -> str:
+    """Strips the Prisma-only query parameters that asyncpg does not understand."""
+    parts = urlsplit(database_url)
+    prisma_params = ("schema", "connection_limit", "pool_timeout")
+    query = [(k, v) for k, v in parse_qsl(parts.query) if k not in prisma_params]
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+def create_backplane(kind: str) -> Backplane:
+    if kind == "postgres":
+        return PostgresBackplane(DATABASE_URL)
+    if kind == "memory":
+        return InMemoryBackplane()
+    raise ValueError(f"Unknown event backplane: {kind}")
+
+
+backplane = create_backplane(EVENT_BACKPLANE)
@@ -0,0 +1,52 @@
+import threading
+from contextvars import ContextVar
+from typing import Optional
+
+# Why a job was stopped. Only a user cancel ends the agreement; on a lost
+# lease or a shutdown another worker reclaims the job and carries on with it.
+CANCELLED_BY_USER = "user"
+LEASE_LOST = "lease_lost"
+SHUTDOWN = "shutdown"
+
+
+class JobCancelledError(Exception):
+    """Raised inside a pipeline once its job has been cancelled."""
+
+
+class CancelEvent(threading.Event):
+    """A threading.Event that also records why the job was stopped."""
+
+    def __init__(self):
+        super().__init__()
+        self.reason: Optional[str] = None
+
+    def cancel(self, reason: str) -> None:
+        if not self.is_set():
+            self.reason = reason
+        self.set()
+
+
+# Set by the job worker for the task running a job; graph nodes inherit the
+# task's context and execute_in_new_thread copies it into the thread pool
+cancel_event: ContextVar[Optional[CancelEvent]] = ContextVar("cancel_event", default=None)
+
+
+def is_cancelled() -> bool:
+    event = cancel_event.get()
+    return event is not None and event.is_set()
+
+
+def raise_if_cancelled() -> None:
+    """Stops pipeline work between LLM calls once the job is cancelled."""
+    if is_cancelled():
+        raise JobCancelledError("Agreement generation was cancelled")
+
+
+def owns_shared_state() -> bool:
+    """Tells whether a stopped pipeline may clean up its agreement's shared state and files.
+
+    A job stopped by a lost lease or a shutdown is reclaimed by another worker,
+    which goes on using the state record and the template file.
+    """
+    event = cancel_event.get()
+    return event is None or event.reason in (None, CANCELLED_BY_USER)
@@ -22,7 +22,11 @@ async def create_user_agreement_status(db, user_id: int, agreement_id: int, stat
         await table.create(
             data={"userId": user_id, "agreementId": agreement_id, "status": status}
         )
-        await notify_clients({"userId": user_id, "status": status})
+        await notify_clients(
+            {"userId": user_id, "status": status, "agreement_id": agreement_id},
+            agreement_id,
+            is_template,
+        )
 
 async def store_final_pdf(db, agreement_id: int, pdf_path: str, is_template: bool = False):
     """Encodes the final PDF and stores it in the database."""
@@ -45,10 +45,9 @@ def send_rejection_email(
                 (current_state.owner_email, "owner", current_state.owner_id)
             )
         # Add all tenants' emails
-        for tenant_id in current_state.tenants.keys():
-            tenant_email = getattr(current_state, "tenant_emails", {}).get(tenant_id)
-            if tenant_email:
-                emails_to_notify.append((tenant_email, "tenant", tenant_id))
+        for tenant_id, tenant in current_state.tenants.items():
+            if tenant.email:
+                emails_to_notify.append((tenant.email, "tenant", tenant_id))
 
     success_list = []
     failed_list = {}
@@ -0,0 +1,128 @@
+import asyncio
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Callable, List, Optional
+from constants import DEFAULT_GENERATION_SECONDS
+from config import GENERATION_CONCURRENCY, MAX_QUEUED_GENERATIONS
+
+
+class GenerationQueueFullError(Exception):
+    """Raised when no more agreements can be queued for generation."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Generation queue is full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class SlotReservation:
+    """A generation slot counted as taken from when a job is claimed until its runner asks for it."""
+
+    def __init__(self, limiter: "GenerationLimiter"):
+        self._limiter = limiter
+        self.held = True
+
+    def release(self) -> None:
+        """Gives the slot back if the runner never used it; safe to call more than once."""
+        if self.held:
+            self.held = False
+            self._limiter.reserved -= 1
+
+
+# Set by the job worker for the task running a job, so the runner's slot() takes
+# over the reservation made when the job was claimed
+slot_reservation: ContextVar[Optional[SlotReservation]] = ContextVar(
+    "slot_reservation", default=None
+)
+
+
+class GenerationLimiter:
+    """Caps concurrent LLM generations on this worker and tracks their wait and service times."""
+
+    def __init__(
+        self,
+        max_concurrent: int = GENERATION_CONCURRENCY,
+        max_queued: int = MAX_QUEUED_GENERATIONS,
+        samples: int = 50,
+    ):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.running = 0
+        self.waiting = 0
+        self.reserved = 0
+        self.rejected = 0
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._wait_times = deque(maxlen=samples)
+        self._service_times = deque(maxlen=samples)
+        self._release_listeners: List[Callable[[], None]] = []
+
+    def on_release(self, listener: Callable[[], None]) -> None:
+        self._release_listeners.append(listener)
+
+    def free_slots(self) -> int:
+        return max(self.max_concurrent - self.running - self.waiting - self.reserved, 0)
+
+    def reserve(self) -> SlotReservation:
+        """Counts a slot as taken for a job that has not reached its generation yet."""
+        self.reserved += 1
+        return SlotReservation(self)
+
+    def average_generation_seconds(self) -> float:
+        if not self._service_times:
+            return DEFAULT_GENERATION_SECONDS
+        return sum(self._service_times) / len(self._service_times)
+
+    def retry_after(self, queued: int) -> int:
+        """Estimates when a slot frees up for a request behind `queued` others."""
+        rounds = (queued + 1) / self.max_concurrent
+        return max(1, math.ceil(rounds * self.average_generation_seconds()))
+
+    def admit(self, queued: int) -> None:
+        """Rejects a new request when `queued` generations are already waiting."""
+        if queued >= self.max_queued:
+            self.rejected += 1
+            raise GenerationQueueFullError(self.retry_after(queued))
+
+    @asynccontextmanager
+    async def slot(self):
+        """Holds one generation slot for the duration of the block."""
+        self.waiting += 1
+        # The job's reservation turns into the wait, so the slot never looks free
+        reservation = slot_reservation.get()
+        if reservation is not None:
+            reservation.release()
+        queued_at = time.monotonic()
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        started_at = time.monotonic()
+        self._wait_times.append(started_at - queued_at)
+        self.running += 1
+        try:
+            yield
+            self._service_times.append(time.monotonic() - started_at)
+        finally:
+            self.running -= 1
+            self._semaphore.release()
+            for listener in self._release_listeners:
+                listener()
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_queued": self.max_queued,
+            "running": self.running,
+            "waiting": self.waiting,
+            "reserved": self.reserved,
+            "rejected": self.rejected,
+            "average_wait_seconds": (
+                sum(self._wait_times) / len(self._wait_times) if self._wait_times else 0.0
+            ),
+            "average_generation_seconds": self.average_generation_seconds(),
+        }
+
+
+generation_limiter = GenerationLimiter()
@@ -0,0 +1,389 @@
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from collections import deque
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, Optional
+from fastapi import HTTPException
+from prisma import Base64, Json
+from prisma.enums import AgreementStatus, JobStatus
+from api.routes.websocket import notify_clients
+from helpers.backplane import backplane
+from helpers.cancellation import (
+    CANCELLED_BY_USER,
+    LEASE_LOST,
+    SHUTDOWN,
+    CancelEvent,
+    cancel_event,
+)
+from helpers.db_operations import update_agreement_status
+from helpers.generation_limiter import generation_limiter, slot_reservation
+from helpers.state_manager import state_manager
+from constants import (
+    JOB_HEARTBEAT_INTERVAL_SECONDS,
+    JOB_LEASE_SECONDS,
+    JOB_MAX_ATTEMPTS,
+    JOB_POLL_INTERVAL_SECONDS,
+    MAX_JOB_PRIORITY,
+)
+from config import JOB_WORKER_CONCURRENCY
+
+logger = logging.getLogger(__name__)
+
+# Claims the next queued job, or a running one whose worker stopped heartbeating.
+# Users take turns: each user's jobs are ranked after the jobs that user already
+# has running, so a bulk submitter cannot starve someone with a single
+# agreement. Priority only orders a user's own jobs and breaks ties between
+# users, since any caller can ask for the highest one.
+CLAIM_JOB_QUERY = """
+WITH "running" AS (
+    SELECT "userId", count(*) AS "runningJobs"
+    FROM "AgreementJob"
+    WHERE "status" = 'RUNNING' AND "leaseExpiresAt" >= now()
+    GROUP BY "userId"
+),
+"ranked" AS (
+    SELECT q."id",
+           COALESCE(r."runningJobs", 0) + row_number() OVER (
+               PARTITION BY q."userId" ORDER BY q."priority" DESC, q."createdAt"
+           ) AS "fairRank"
+    FROM "AgreementJob" q
+    LEFT JOIN "running" r ON r."userId" = q."userId"
+    WHERE q."status" = 'QUEUED'
+       OR (q."status" = 'RUNNING' AND q."leaseExpiresAt" < now())
+)
+UPDATE "AgreementJob"
+SET "status" = 'RUNNING',
+    "workerId" = $1,
+    "attempts" = "attempts" + 1,
+    "heartbeatAt" = now(),
+    "leaseExpiresAt" = now() + interval '{lease_seconds} seconds',
+    "startedAt" = COALESCE("startedAt", now())
+WHERE "id" = (
+    SELECT j."id"
+    FROM "AgreementJob" j
+    JOIN "ranked" k ON k."id" = j."id"
+    WHERE j."status" = 'QUEUED'
+       OR (j."status" = 'RUNNING' AND j."leaseExpiresAt" < now())
+    ORDER BY k."fairRank", j."priority" DESC, j."createdAt"
+    FOR UPDATE OF j SKIP LOCKED
+    LIMIT 1
+)
+  -- Postgres re-checks these against the locked row, so a job another worker
+  -- claimed after this snapshot was taken is not claimed a second time
+  AND ("status" = 'QUEUED' OR ("status" = 'RUNNING' AND "leaseExpiresAt" < now()))
+RETURNING "id"
+"""
+
+# Extends the lease only while this worker still owns the job
+HEARTBEAT_QUERY = """
+UPDATE "AgreementJob"
+SET "heartbeatAt" = now(),
+    "leaseExpiresAt" = now() + interval '{lease_seconds} seconds'
+WHERE "id" = $1 AND "workerId" = $2 AND "status" = 'RUNNING'
+"""
+
+
+def job_to_dict(job) -> dict:
+    return {
+        "job_id": job.id,
+        "agreement_id": job.agreementId,
+        "agreement_type": job.kind,
+        "user_id": job.userId,
+        "priority": job.priority,
+        "status": job.status,
+        "result": job.result,
+        "error": job.error,
+        "attempts": job.attempts,
+        "created_at": job.createdAt.isoformat(),
+        "started_at": job.startedAt.isoformat() if job.startedAt else None,
+        "finished_at": job.finishedAt.isoformat() if job.finishedAt else None,
+    }
+
+
+class JobManager:
+    """Durable agreement job queue on Postgres, drained by a worker loop in every process."""
+
+    def __init__(
+        self,
+        concurrency: int = JOB_WORKER_CONCURRENCY,
+        poll_interval: float = JOB_POLL_INTERVAL_SECONDS,
+        lease_seconds: int = JOB_LEASE_SECONDS,
+        heartbeat_interval: float = JOB_HEARTBEAT_INTERVAL_SECONDS,
+        max_attempts: int = JOB_MAX_ATTEMPTS,
+    ):
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.lease_seconds = int(lease_seconds)
+        self.heartbeat_interval = heartbeat_interval
+        self.max_attempts = max_attempts
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._runners: Dict[str, Callable[[object, object], Awaitable[dict]]] = {}
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self._cancel_events: Dict[int, CancelEvent] = {}
+        self._wakeup = asyncio.Event()
+        self._poll_task = None
+        self._db = None
+        self._queue_wait_times = deque(maxlen=50)
+
+    def register(self, kind: str, runner: Callable[[object, object], Awaitable[dict]]) -> None:
+        """Registers the coroutine that runs jobs of the given kind as runner(job, db)."""
+        self._runners[kind] = runner
+
+    async def enqueue(
+        self,
+        db,
+        kind: str,
+        agreement_id: int,
+        user_id: str,
+        payload: dict,
+        priority: int = 0,
+        template_file: Optional[bytes] = None,
+        template_file_name: Optional[str] = None,
+        idempotency_key: Optional[str] = None,
+    ):
+        """Inserts a queued job; call announce() once the surrounding transaction commits."""
+        data = {
+            "kind": kind,
+            "agreementId": agreement_id,
+            "userId": user_id,
+            "priority": min(max(priority, 0), MAX_JOB_PRIORITY),
+            "payload": Json(payload),
+        }
+        if template_file is not None:
+            data["templateFile"] = Base64.encode(template_file)
+            data["templateFileName"] = template_file_name
+        if idempotency_key:
+            data["idempotencyKey"] = idempotency_key
+        return await db.agreementjob.create(data=data)
+
+    async def announce(self, job) -> None:
+        # Idle workers on every node claim right away instead of on their next poll
+        await backplane.publish("jobs", {"job_id": job.id})
+
+    async def get(self, db, job_id: int):
+        return await db.agreementjob.find_unique(where={"id": job_id})
+
+    async def get_by_idempotency_key(self, db, user_id: str, idempotency_key: str):
+        return await db.agreementjob.find_unique(
+            where={
+                "userId_idempotencyKey": {
+                    "userId": user_id,
+                    "idempotencyKey": idempotency_key,
+                }
+            }
+        )
+
+    async def cancel(self, db, kind: str, agreement_id: int) -> bool:
+        """Cancels the agreement's queued or running job, returning False if it already finished."""
+        job = await db.agreementjob.find_first(
+            where={"kind": kind, "agreementId": agreement_id},
+            order={"createdAt": "desc"},
+        )
+        if job is None:
+            return False
+        cancelled = await db.agreementjob.update_many(
+            where={
+                "id": job.id,
+                "status": {"in": [JobStatus.QUEUED, JobStatus.RUNNING]},
+            },
+            data={"status": JobStatus.CANCELLED, "finishedAt": datetime.now(timezone.utc)},
+        )
+        if not cancelled:
+            return False
+        # Whichever worker runs the job stops it; a missed event is caught by its heartbeat
+        await backplane.publish("cancel", {"job_id": job.id})
+        return True
+
+    def stop_local(self, event: dict) -> None:
+        """Stops a job running on this worker after it was cancelled anywhere."""
+        self._stop(event["job_id"], CANCELLED_BY_USER)
+
+    def _stop(self, job_id: int, reason: str) -> None:
+        # The runner reads the reason to tell a cancelled agreement from a job
+        # another worker is about to reclaim
+        if job_id in self._cancel_events:
+            self._cancel_events[job_id].cancel(reason)
+        task = self._tasks.get(job_id)
+        if task:
+            logger.info(f"Cancelling job {job_id} ({reason})")
+            task.cancel()
+
+    async def queued_count(self, db) -> int:
+        return await db.agreementjob.count(where={"status": JobStatus.QUEUED})
+
+    def wake(self, _event: Optional[dict] = None) -> None:
+        self._wakeup.set()
+
+    def start(self, db) -> None:
+        self._db = db
+        self._poll_task = asyncio.create_task(self._poll_loop())
+
+    async def shutdown(self) -> None:
+        # Unfinished jobs keep their lease and are reclaimed once it expires
+        tasks = list(self._tasks.values())
+        for job_id in list(self._tasks):
+            self._stop(job_id, SHUTDOWN)
+        if self._poll_task:
+            tasks.append(self._poll_task)
+            self._poll_task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _poll_loop(self) -> None:
+        while True:
+            try:
+                # Jobs start with generation, so only claim what this worker can generate
+                # now and leave the rest queued for workers with free slots. The slot
+                # is reserved before claiming, since the runner only takes it later
+                claimable = min(
+                    self.concurrency - len(self._tasks), generation_limiter.free_slots()
+                )
+                for _ in range(claimable):
+                    reservation = generation_limiter.reserve()
+                    try:
+                        job = await self._claim()
+                    except BaseException:
+                        reservation.release()
+                        raise
+                    if job is None:
+                        reservation.release()
+                        break
+                    self._tasks[job.id] = asyncio.create_task(self._run(job, reservation))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Job worker {self.worker_id} failed to claim: {str(e)}")
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _claim(self):
+        rows = await self._db.query_raw(
+            CLAIM_JOB_QUERY.format(lease_seconds=self.lease_seconds), self.worker_id
+        )
+        if not rows:
+            return None
+        job = await self._db.agreementjob.find_unique(where={"id": rows[0]["id"]})
+        if job.attempts == 1:
+            self._queue_wait_times.append((job.startedAt - job.createdAt).total_seconds())
+        return job
+
+    async def _heartbeat(self, job_id: int) -> None:
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            updated = await self._db.execute_raw(
+                HEARTBEAT_QUERY.format(lease_seconds=self.lease_seconds),
+                job_id,
+                self.worker_id,
+            )
+            if not updated:
+                # Also reached when the cancel event was missed
+                job = await self._db.agreementjob.find_unique(where={"id": job_id})
+                if job is not None and job.status == JobStatus.CANCELLED:
+                    self._stop(job_id, CANCELLED_BY_USER)
+                else:
+                    logger.warning(f"Lost lease on job {job_id}, stopping it")
+                    self._stop(job_id, LEASE_LOST)
+                return
+
+    async def _run(self, job, reservation) -> None:
+        self._cancel_events[job.id] = CancelEvent()
+        cancel_event.set(self._cancel_events[job.id])
+        slot_reservation.set(reservation)
+        heartbeat = asyncio.create_task(self._heartbeat(job.id))
+        status, result, error = JobStatus.FAILED, None, None
+        try:
+            if job.attempts > self.max_attempts or job.kind not in self._runners:
+                if job.attempts > self.max_attempts:
+                    error = f"Gave up after {job.attempts - 1} attempts"
+                else:
+                    error = f"No runner registered for {job.kind} jobs"
+                # No pipeline runs to fail its agreement, so it is done here
+                await self._fail_agreement(job)
+            else:
+                if job.attempts > 1:
+                    # Runners start over: the agreement is generated and emailed again
+                    # under new party ids, so links from the earlier attempt stop working
+                    logger.info(
+                        f"Restarting job {job.id} from scratch (attempt {job.attempts})"
+                    )
+                result = await self._runners[job.kind](job, self._db)
+                status = JobStatus.COMPLETED
+        except asyncio.CancelledError:
+            # Cancelled jobs are already marked in the table; on shutdown or a lost
+            # lease the row is left for whichever worker reclaims it
+            raise
+        except HTTPException as e:
+            error = str(e.detail)
+        except Exception as e:
+            logger.error(f"Job {job.id} for agreement {job.agreementId} failed: {str(e)}")
+            error = str(e)
+        finally:
+            # Jobs that end before generating never hand their slot to the limiter
+            reservation.release()
+            heartbeat.cancel()
+            self._tasks.pop(job.id, None)
+            self._cancel_events.pop(job.id, None)
+        await self._finish(job, status, result, error)
+        self._wakeup.set()
+
+    async def _fail_agreement(self, job) -> None:
+        """Marks the job's agreement FAILED and drops its state, as a failing pipeline does."""
+        is_template = job.kind == "template"
+        try:
+            await update_agreement_status(
+                self._db, job.agreementId, AgreementStatus.FAILED, is_template
+            )
+            if is_template:
+                await state_manager.cleanup_template_agreement_state(job.agreementId)
+            else:
+                await state_manager.cleanup_agreement_state(job.agreementId)
+        except Exception as e:
+            logger.error(f"Failed to mark agreement {job.agreementId} as failed: {str(e)}")
+
+    async def _finish(
+        self, job, status: JobStatus, result: Optional[dict], error: Optional[str]
+    ) -> None:
+        try:
+            data = {"status": status, "error": error, "finishedAt": datetime.now(timezone.utc)}
+            if result is not None:
+                data["result"] = Json(result)
+            # A job cancelled or reclaimed in the meantime keeps the status it has now
+            updated = await self._db.agreementjob.update_many(
+                where={"id": job.id, "status": JobStatus.RUNNING, "workerId": self.worker_id},
+                data=data,
+            )
+            if not updated:
+                logger.info(f"Job {job.id} was taken over before it finished, not recording {status}")
+                return
+            finished = await self._db.agreementjob.find_unique(where={"id": job.id})
+            await notify_clients(
+                {"type": "job", **job_to_dict(finished)},
+                job.agreementId,
+                job.kind == "template",
+            )
+        except Exception as e:
+            logger.error(f"Failed to record completion of job {job.id}: {str(e)}")
+
+
+    def stats(self) -> dict:
+        return {
+            "worker_id": self.worker_id,
+            "running_jobs": len(self._tasks),
+            "max_running_jobs": self.concurrency,
+            "average_queue_wait_seconds": (
+                sum(self._queue_wait_times) / len(self._queue_wait_times)
+                if self._queue_wait_times
+                else 0.0
+            ),
+        }
+
+
+job_manager = JobManager()
+backplane.on("jobs", job_manager.wake)
+backplane.on("cancel", job_manager.stop_local)
+generation_limiter.on_release(job_manager.wake)
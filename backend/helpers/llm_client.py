@@ -0,0 +1,16 @@
+import httpx
+from config import LLM_MAX_CONNECTIONS
+
+# Shared by every ChatOpenAI instance so concurrent generations reuse pooled
+# connections to the model server. Timeouts are left to the models, as before.
+http_async_client = httpx.AsyncClient(
+    timeout=None,
+    limits=httpx.Limits(
+        max_connections=LLM_MAX_CONNECTIONS,
+        max_keepalive_connections=LLM_MAX_CONNECTIONS,
+    ),
+)
+
+
+async def close_http_async_client():
+    await http_async_client.aclose()
@@ -4,6 +4,9 @@ from langgraph.graph import StateGraph, START, END
 from langchain_openai import ChatOpenAI
 from langchain.memory import ConversationBufferMemory
 from helpers.state_manager import State, state_manager
+from helpers.cancellation import raise_if_cancelled
+from helpers.llm_client import http_async_client
+from helpers.thread_executer import execute_in_new_thread
 import os
 from PIL import Image
 from templates import format_agreement_details
@@ -22,6 +25,7 @@ llm = ChatOpenAI(
     max_retries=2,
     api_key="",
     base_url=CHAT_OPENAI_BASE_URL,
+    http_async_client=http_async_client,
 )
 
 
@@ -74,7 +78,7 @@ def generate_furniture_table(furniture: List[Dict[str, str]]) -> str:
     return table
 
 
-def generate_agreement(state: State):
+async def generate_agreement(state: State):
     """Generates the complete rental agreement by combining all sections."""
     agreement_id = state["agreement_id"]
     current_state = state_manager.get_agreement_state(agreement_id)
@@ -122,7 +126,8 @@ def generate_agreement(state: State):
         {"role": "system", "content": AGREEMENT_SYSTEM_PROMPT},
         {"role": "user", "content": agreement_details},
     ]
-    response = llm.invoke(messages)
+    raise_if_cancelled()
+    response = await llm.ainvoke(messages)
     content_response = response.content
 
     # Combine all sections into the final agreement
@@ -198,10 +203,11 @@ def create_pdf(state: State):
         else:
             content = content.replace("[OWNER PHOTO]", state.owner_photo)
 
-        # Replace tenant signatures with numbered placeholders and images
-        for i, (tenant_id, signature) in enumerate(state.tenant_signatures.items(), 1):
+        # Replace tenant signatures and photos with numbered placeholders and images,
+        # numbered in the order of the signature table
+        for i, tenant in enumerate(state.tenants.values(), 1):
             placeholder = f"[TENANT {i} SIGNATURE]"
-            tenant_name = state.tenant_names.get(tenant_id, f"Tenant {i}")
+            signature = tenant.signature
 
             if os.path.isfile(signature):
                 tenant_signature_data, _ = resize_image(signature, 60, 30)
@@ -211,10 +217,8 @@ def create_pdf(state: State):
             else:
                 content = content.replace(placeholder, signature)
 
-        # Replace tenant photos with numbered placeholders and images
-        for i, (tenant_id, photo) in enumerate(state.tenant_photos.items(), 1):
             placeholder = f"[TENANT {i} PHOTO]"
-            tenant_name = state.tenant_names.get(tenant_id, f"Tenant {i}")
+            photo = tenant.photo
             if os.path.isfile(photo):
                 tenant_photos_data, _ = resize_image(photo, 60, 60)
                 content = content.replace(
@@ -240,10 +244,16 @@ def create_pdf(state: State):
     return {"messages": content}
 
 
+async def render_pdf(state: State):
+    # PDF rendering blocks, so it runs in the thread pool while the LLM calls
+    # stay on the event loop
+    return await execute_in_new_thread(create_pdf, state)
+
+
 # Build graph
 graph_builder = StateGraph(State)
 graph_builder.add_node("generate", generate_agreement)
-graph_builder.add_node("create_pdf", create_pdf)
+graph_builder.add_node("create_pdf", render_pdf)
 graph_builder.add_edge(START, "generate")
 graph_builder.add_edge("generate", "create_pdf")
 graph_builder.add_edge("create_pdf", END)
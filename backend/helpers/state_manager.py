@@ -1,30 +1,102 @@
-from typing import Annotated, Dict, Optional, List
+from typing import Annotated, Callable, Dict, Optional, List, Tuple, Union
+import asyncio
+import logging
+import os
+import sys
+import time
 import uuid
+import zlib
 from typing_extensions import TypedDict
 from langgraph.graph.message import add_messages
-from dataclasses import dataclass, field
+from collections import Counter
+from contextlib import asynccontextmanager
+from dataclasses import asdict, dataclass, field, fields
 from datetime import datetime
 from models.rental_agreement import AgreementRequest
+from helpers.state_store import StaleStateError, state_store
+from helpers.upload_store import upload_store
+from config import STATE_TTL_SECONDS
+
+# Attempts an update makes to apply its change on top of the latest stored state
+STATE_UPDATE_ATTEMPTS = 5
 
 class State(TypedDict):
     messages: Annotated[list, add_messages]
     agreement_id: int
 
 
-@dataclass
+# Fields that describe this worker's copy rather than the agreement
+LOCAL_STATE_FIELDS = ("version", "touched_at")
+# Fields kept zlib-compressed in memory, mapped to the property exposing the text
+COMPRESSED_TEXT_FIELDS = {"_agreement_text": "agreement_text"}
+
+
+class StateNotFoundError(LookupError):
+    """Raised when updating a state that no worker has stored."""
+
+
+def existing_files(paths) -> List[str]:
+    # Signature and photo fields hold placeholder text once approved without an upload
+    return [path for path in paths if path and os.path.isfile(path)]
+
+
+def compress_text(text: str) -> bytes:
+    # Level 1 already shrinks agreement markdown severalfold at a fraction of the CPU
+    return zlib.compress(text.encode(), 1) if text else b""
+
+
+def decompress_text(data: bytes) -> str:
+    return zlib.decompress(data).decode() if data else ""
+
+
+def intern_string(value):
+    """Shares one copy of strings that repeat across agreements, such as cities and amenities."""
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def state_to_dict(state) -> dict:
+    """Returns the stored form of a state, without the fields local to this worker."""
+    data = {}
+    for f in fields(state):
+        if f.name in LOCAL_STATE_FIELDS:
+            continue
+        name = COMPRESSED_TEXT_FIELDS.get(f.name, f.name)
+        data[name] = getattr(state, name)
+    return data
+
+
+def load_state_dict(state, data: dict, version: int) -> None:
+    """Overwrites the state in place, so references held elsewhere see the stored values."""
+    known_fields = {COMPRESSED_TEXT_FIELDS.get(f.name, f.name) for f in fields(state)}
+    for name, value in data.items():
+        if name in known_fields:
+            setattr(state, name, value)
+    state.version = version
+
+
+@dataclass(slots=True)
+class Party:
+    """One tenant of a rent agreement, from invitation to approval."""
+
+    name: str = ""
+    email: str = ""
+    address: str = ""
+    approved: bool = False
+    signature: str = ""
+    photo: str = ""
+
+
+@dataclass(slots=True)
 class AgreementState:
     owner_id: str = field(default_factory=lambda: str(uuid.uuid4()))
     owner_name: str = ""
     owner_email: str = ""
-    tenant_emails: Dict[str, Optional[str]] = field(default_factory=dict)
-    tenants: Dict[str, bool] = field(default_factory=dict)
-    tenant_names: Dict[str, str] = field(default_factory=dict)
+    # Keyed by the tenant id sent in the approval links, in the order tenants were added
+    tenants: Dict[str, Party] = field(default_factory=dict)
     owner_approved: bool = False
-    agreement_text: str = ""
+    _agreement_text: bytes = b""
     owner_signature: str = ""
-    tenant_signatures: Dict[str, Optional[str]] = field(default_factory=dict)
     owner_photo: str = ""
-    tenant_photos: Dict[str, Optional[str]] = field(default_factory=dict)
     pdf_file_path: str = ""
     is_pdf_generated: bool = False
     agreement_id: Optional[int] = None
@@ -33,7 +105,6 @@ class AgreementState:
     rent_amount: int = 0
     agreement_period: List[datetime] = field(default_factory=list)
     owner_address: str = ""
-    tenant_details: list[dict] = field(default_factory=list)
     furnishing_type: str = ""
     security_deposit: int = 0
     bhk_type: str = ""
@@ -42,31 +113,86 @@ class AgreementState:
     furniture_and_appliances: List[Dict[str, str]] = field(default_factory=list)
     amenities: List[str] = field(default_factory=list)
     user_id: str = ""
+    # Version of the stored state this copy was loaded from or last saved as
+    version: int = 0
+    # Monotonic time this worker last used the state, for TTL eviction
+    touched_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def agreement_text(self) -> str:
+        return decompress_text(self._agreement_text)
+
+    @agreement_text.setter
+    def agreement_text(self, text: str) -> None:
+        self._agreement_text = compress_text(text)
+
+    @property
+    def tenant_details(self) -> List[Dict[str, str]]:
+        """Tenants in the shape of the request's tenant_details."""
+        return [
+            {"name": tenant.name, "email": tenant.email, "address": tenant.address}
+            for tenant in self.tenants.values()
+        ]
 
     def reset(self) -> None:
         """Resets the agreement state to its default values."""
         self.__init__()
 
-    def add_tenant(self, tenant_email: str, tenant_name: str) -> str:
+    def to_dict(self) -> dict:
+        data = state_to_dict(self)
+        data["tenants"] = {
+            tenant_id: asdict(tenant) for tenant_id, tenant in self.tenants.items()
+        }
+        data["agreement_period"] = [
+            date.isoformat() if isinstance(date, datetime) else date
+            for date in self.agreement_period
+        ]
+        return data
+
+    def load_dict(self, data: dict, version: int) -> None:
+        load_state_dict(self, data, version)
+        self.tenants = {
+            tenant_id: Party(**tenant) for tenant_id, tenant in self.tenants.items()
+        }
+        self.agreement_period = [
+            datetime.fromisoformat(date) if isinstance(date, str) else date
+            for date in self.agreement_period
+        ]
+        self._intern_details()
+
+    def upload_paths(self) -> List[str]:
+        """Returns the photo and signature fields, which hold upload paths until approval."""
+        paths = [self.owner_photo, self.owner_signature]
+        for tenant in self.tenants.values():
+            paths.extend([tenant.photo, tenant.signature])
+        return paths
+
+    def file_paths(self) -> List[str]:
+        """Returns the files on this worker's disk that belong to the agreement."""
+        return existing_files([self.pdf_file_path, *self.upload_paths()])
+
+    def add_tenant(self, tenant_email: str, tenant_name: str, tenant_address: str = "") -> str:
         """Adds a new tenant to the agreement."""
         tenant_id = str(uuid.uuid4())
-        self.tenants[tenant_id] = False  # False indicates not yet approved
-        self.tenant_names[tenant_id] = tenant_name
-        self.tenant_emails[tenant_id] = tenant_email
+        self.tenants[tenant_id] = Party(
+            name=tenant_name, email=tenant_email, address=tenant_address
+        )
         return tenant_id
 
     def update_tenant(self, tenant_signature: str, tenant_photo: str, tenant_id: str):
-        self.tenant_signatures[tenant_id] = tenant_signature
-        self.tenant_photos[tenant_id] = tenant_photo
+        tenant = self.tenants[tenant_id]
+        tenant.signature = tenant_signature
+        tenant.photo = tenant_photo
 
     def set_owner(self, owner_name: str, owner_email: str) -> None:
         """Sets the owner's name."""
         self.owner_name = owner_name
         self.owner_email = owner_email
-        
+
     def set_agreement_details(self, request: AgreementRequest) -> None:
         """
         Sets only the required agreement details from the request object.
+        Tenants are added separately through add_tenant.
         """
         fields_to_set = [
             "property_address",
@@ -87,20 +213,28 @@ class AgreementState:
         for field in fields_to_set:
             if hasattr(request, field):
                 setattr(self, field, getattr(request, field))
+        self._intern_details()
 
-        # Handle tenant_details explicitly
-        if hasattr(request, "tenant_details") and isinstance(request.tenant_details, list):
-            if all(isinstance(tenant, dict) for tenant in request.tenant_details):
-                self.tenant_details = request.tenant_details
-            else:
-                raise ValueError("tenant_details must be a list of dictionaries.")
+    def _intern_details(self) -> None:
+        # Pending agreements mostly differ in names and text; these values repeat
+        self.city = intern_string(self.city)
+        self.furnishing_type = intern_string(self.furnishing_type)
+        self.bhk_type = intern_string(self.bhk_type)
+        self.user_id = intern_string(self.user_id)
+        self.amenities = [intern_string(amenity) for amenity in self.amenities]
+        self.furniture_and_appliances = [
+            {intern_string(key): intern_string(value) for key, value in item.items()}
+            for item in self.furniture_and_appliances
+        ]
 
     def is_fully_approved(self) -> bool:
         """Checks if the agreement is fully approved."""
-        return self.owner_approved and all(self.tenants.values())
+        return self.owner_approved and all(
+            tenant.approved for tenant in self.tenants.values()
+        )
 
 
-@dataclass
+@dataclass(slots=True)
 class TemplateAgreementState:
     authority_id: str = field(default_factory=lambda: str(uuid.uuid4()))
     participant_id: str = field(default_factory=lambda: str(uuid.uuid4()))
@@ -108,7 +242,7 @@ class TemplateAgreementState:
     participant_email: str = ""
     authority_approved: bool = False
     participant_approved: bool = False
-    agreement_text: str = ""
+    _agreement_text: bytes = b""
     authority_signature: str = ""
     participant_signature: str = ""
     pdf_file_path: str = ""
@@ -117,11 +251,41 @@ class TemplateAgreementState:
     agreement_id: Optional[int] = None
     pdf_font_name: str = ""
     pdf_font_file: str = ""
+    # Version of the stored state this copy was loaded from or last saved as
+    version: int = 0
+    # Monotonic time this worker last used the state, for TTL eviction
+    touched_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def agreement_text(self) -> str:
+        return decompress_text(self._agreement_text)
+
+    @agreement_text.setter
+    def agreement_text(self, text: str) -> None:
+        self._agreement_text = compress_text(text)
 
     def reset(self) -> None:
         """Agreement state to its default values."""
         self.__init__()
 
+    def to_dict(self) -> dict:
+        return state_to_dict(self)
+
+    def load_dict(self, data: dict, version: int) -> None:
+        load_state_dict(self, data, version)
+        self.pdf_font_name = intern_string(self.pdf_font_name)
+        self.pdf_font_file = intern_string(self.pdf_font_file)
+
+    def upload_paths(self) -> List[str]:
+        """Returns the signature fields, which hold upload paths until approval."""
+        return [self.authority_signature, self.participant_signature]
+
+    def file_paths(self) -> List[str]:
+        """Returns the files on this worker's disk that belong to the agreement."""
+        return existing_files(
+            [self.pdf_file_path, self.template_file_path, *self.upload_paths()]
+        )
+
     def set_authority(self, authority_email):
         self.authority_email = authority_email
 
@@ -133,40 +297,201 @@ class TemplateAgreementState:
         return self.participant_approved and self.authority_approved
 
 
+AnyAgreementState = Union[AgreementState, TemplateAgreementState]
+
+# Kinds under which the states are kept in the shared store
+RENT_STATE = "rent"
+TEMPLATE_STATE = "template"
+
+
 class StateManager:
-    def __init__(self):
+    """Holds this worker's copies of the agreement states.
+
+    Coroutines that load, save or update a state are serialized per agreement,
+    so approvals, uploads and listeners of one agreement never interleave
+    while different agreements proceed in parallel. Before the state is first
+    saved it belongs to the job generating the agreement alone, including the
+    generator threads reaching it through get_agreement_state.
+    """
+
+    def __init__(self, ttl_seconds: int = STATE_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
         self._agreement_states: Dict[int, AgreementState] = {}
         self._template_agreement_states: Dict[int, TemplateAgreementState] = {}
-        self._current_agreement_id: Optional[int] = None
-        self._current_template_agreement_id: Optional[int] = None
+        self._locks: Dict[Tuple[str, int], asyncio.Lock] = {}
+        self._lock_users: Counter = Counter()
+        self.evicted = 0
 
     def get_agreement_state(self, agreement_id: int) -> AgreementState:
-        if agreement_id not in self._agreement_states:
-            state = AgreementState()
-            state.agreement_id = agreement_id
-            self._agreement_states[agreement_id] = state
-        return self._agreement_states[agreement_id]
+        state = self._agreement_states.get(agreement_id)
+        if state is None:
+            # setdefault keeps one state when generator threads race to create it
+            state = self._agreement_states.setdefault(
+                agreement_id, AgreementState(agreement_id=agreement_id)
+            )
+        state.touched_at = time.monotonic()
+        return state
 
     def get_template_agreement_state(self, agreement_id: int) -> TemplateAgreementState:
-        if agreement_id not in self._template_agreement_states:
-            state = TemplateAgreementState()
-            state.agreement_id = agreement_id
-            self._template_agreement_states[agreement_id] = state
-        return self._template_agreement_states[agreement_id]
+        state = self._template_agreement_states.get(agreement_id)
+        if state is None:
+            state = self._template_agreement_states.setdefault(
+                agreement_id, TemplateAgreementState(agreement_id=agreement_id)
+            )
+        state.touched_at = time.monotonic()
+        return state
+
+    async def cleanup_agreement_state(self, agreement_id: int) -> None:
+        async with self._lock(RENT_STATE, agreement_id):
+            self._agreement_states.pop(agreement_id, None)
+            await state_store.delete(RENT_STATE, agreement_id)
+            await upload_store.delete(RENT_STATE, agreement_id)
+
+    async def cleanup_template_agreement_state(self, agreement_id: int) -> None:
+        async with self._lock(TEMPLATE_STATE, agreement_id):
+            self._template_agreement_states.pop(agreement_id, None)
+            await state_store.delete(TEMPLATE_STATE, agreement_id)
+            await upload_store.delete(TEMPLATE_STATE, agreement_id)
+
+    async def load_agreement_state(self, agreement_id: int) -> Optional[AgreementState]:
+        """Returns this worker's copy of the state, refreshed from the shared store.
+
+        Returns None for an agreement no worker has stored, without creating a state for it.
+        """
+        async with self._lock(RENT_STATE, agreement_id):
+            return await self._load(RENT_STATE, agreement_id)
+
+    async def load_template_agreement_state(
+        self, agreement_id: int
+    ) -> Optional[TemplateAgreementState]:
+        """Returns this worker's copy of the state, refreshed from the shared store.
+
+        Returns None for an agreement no worker has stored, without creating a state for it.
+        """
+        async with self._lock(TEMPLATE_STATE, agreement_id):
+            return await self._load(TEMPLATE_STATE, agreement_id)
+
+    async def save_agreement_state(self, state: AgreementState) -> None:
+        """Publishes the state to other workers, raising StaleStateError if it changed meanwhile."""
+        async with self._lock(RENT_STATE, state.agreement_id):
+            await self._save(RENT_STATE, state)
+
+    async def save_template_agreement_state(self, state: TemplateAgreementState) -> None:
+        """Publishes the state to other workers, raising StaleStateError if it changed meanwhile."""
+        async with self._lock(TEMPLATE_STATE, state.agreement_id):
+            await self._save(TEMPLATE_STATE, state)
+
+    async def update_agreement_state(
+        self, agreement_id: int, mutate: Callable[[AgreementState], object]
+    ):
+        """Applies mutate to the latest stored state and saves it, retrying on conflicts.
+
+        Returns whatever mutate returned on the attempt that was saved.
+        """
+        async with self._lock(RENT_STATE, agreement_id):
+            return await self._update(RENT_STATE, agreement_id, mutate)
+
+    async def update_template_agreement_state(
+        self, agreement_id: int, mutate: Callable[[TemplateAgreementState], object]
+    ):
+        """Applies mutate to the latest stored state and saves it, retrying on conflicts.
+
+        Returns whatever mutate returned on the attempt that was saved.
+        """
+        async with self._lock(TEMPLATE_STATE, agreement_id):
+            return await self._update(TEMPLATE_STATE, agreement_id, mutate)
+
+    def evict_expired(self) -> List[AnyAgreementState]:
+        """Drops this worker's copies that were not used within the TTL and returns them.
+
+        The TTL outlasts generation plus the approval window, so an expired
+        state belongs to an agreement that was abandoned without cleanup.
+        """
+        deadline = time.monotonic() - self.ttl_seconds
+        evicted = []
+        for states in (self._agreement_states, self._template_agreement_states):
+            # Generation threads may add states while this runs
+            for agreement_id, state in list(states.items()):
+                if state.touched_at < deadline:
+                    states.pop(agreement_id, None)
+                    evicted.append(state)
+        self.evicted += len(evicted)
+        return evicted
+
+    def stats(self) -> dict:
+        return {
+            "live_agreement_states": len(self._agreement_states),
+            "live_template_agreement_states": len(self._template_agreement_states),
+            "evicted_states": self.evicted,
+            "locked_states": len(self._locks),
+        }
+
+    @asynccontextmanager
+    async def _lock(self, kind: str, agreement_id: int):
+        # Locks exist only while a coroutine holds or awaits them, so they
+        # cannot pile up for agreements that are long gone
+        key = (kind, agreement_id)
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        self._lock_users[key] += 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._lock_users[key] -= 1
+            if not self._lock_users[key]:
+                del self._lock_users[key]
+                del self._locks[key]
+
+    def _states(self, kind: str) -> Dict[int, AnyAgreementState]:
+        if kind == TEMPLATE_STATE:
+            return self._template_agreement_states
+        return self._agreement_states
+
+    def _get_state(self, kind: str, agreement_id: int) -> AnyAgreementState:
+        if kind == TEMPLATE_STATE:
+            return self.get_template_agreement_state(agreement_id)
+        return self.get_agreement_state(agreement_id)
 
-    def cleanup_agreement_state(self, agreement_id: int) -> None:
-        if agreement_id in self._agreement_states:
-            del self._agreement_states[agreement_id]
+    async def _load(self, kind: str, agreement_id: int) -> Optional[AnyAgreementState]:
+        record = await state_store.load(kind, agreement_id)
+        if record is None:
+            # Unknown ids from the routes must not leave empty states behind
+            if agreement_id not in self._states(kind):
+                return None
+            return self._get_state(kind, agreement_id)
 
-    def cleanup_template_agreement_state(self, agreement_id: int) -> None:
-        if agreement_id in self._template_agreement_states:
-            del self._template_agreement_states[agreement_id]
+        state = self._get_state(kind, agreement_id)
+        data, version = record
+        # An equal version means this copy is current, possibly with unsaved changes
+        if version > state.version:
+            state.load_dict(data, version)
+        return state
 
-    def set_current_agreement_id(self, agreement_id: int) -> None:
-        self._current_agreement_id = agreement_id
+    async def _save(self, kind: str, state: AnyAgreementState) -> None:
+        state.version = await state_store.save(
+            kind, state.agreement_id, state.to_dict(), state.version
+        )
 
-    def set_current_template_agreement_id(self, agreement_id: int) -> None:
-        self._current_template_agreement_id = agreement_id
+    async def _update(
+        self,
+        kind: str,
+        agreement_id: int,
+        mutate: Callable[[AnyAgreementState], object],
+    ):
+        for _ in range(STATE_UPDATE_ATTEMPTS):
+            state = await self._load(kind, agreement_id)
+            if state is None:
+                raise StateNotFoundError(f"No {kind} state for agreement {agreement_id}")
+            result = mutate(state)
+            try:
+                await self._save(kind, state)
+                return result
+            except StaleStateError as e:
+                # The next load overwrites this attempt's changes with the newer state
+                logging.info(f"Retrying state update after conflict: {str(e)}")
+        raise StaleStateError(
+            f"Could not update {kind} state after {STATE_UPDATE_ATTEMPTS} attempts"
+        )
 
 
 # Create a singleton instance
@@ -0,0 +1,140 @@
+import copy
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional, Tuple
+from prisma import Json
+from prisma.errors import UniqueViolationError
+from config import STATE_STORE
+from database.connection import conn_manager
+
+
+class StaleStateError(Exception):
+    """Raised when the stored state was changed by another worker since it was loaded."""
+
+
+class StateStore:
+    """Versioned storage for agreement states shared by every worker.
+
+    Each save must name the version it was based on, so concurrent writers
+    cannot silently overwrite each other's changes.
+    """
+
+    async def load(self, kind: str, agreement_id: int) -> Optional[Tuple[dict, int]]:
+        """Returns the stored state data and its version, or None if there is none."""
+        raise NotImplementedError
+
+    async def save(self, kind: str, agreement_id: int, data: dict, version: int) -> int:
+        """Stores data over the given version and returns the new version.
+
+        Raises StaleStateError if the stored version is no longer `version`.
+        Version 0 means the state has never been saved.
+        """
+        raise NotImplementedError
+
+    async def delete(self, kind: str, agreement_id: int) -> None:
+        raise NotImplementedError
+
+    async def delete_expired(self, max_age_seconds: int) -> int:
+        """Deletes the states not saved within max_age_seconds and returns how many."""
+        raise NotImplementedError
+
+
+class InMemoryStateStore(StateStore):
+    """Keeps the states in the current process only, for tests and single-worker runs."""
+
+    def __init__(self):
+        # (kind, agreement_id) -> (data, version, monotonic time it was saved)
+        self._records: Dict[Tuple[str, int], Tuple[dict, int, float]] = {}
+
+    async def load(self, kind: str, agreement_id: int) -> Optional[Tuple[dict, int]]:
+        record = self._records.get((kind, agreement_id))
+        if record is None:
+            return None
+        data, version, _ = record
+        return copy.deepcopy(data), version
+
+    async def save(self, kind: str, agreement_id: int, data: dict, version: int) -> int:
+        record = self._records.get((kind, agreement_id))
+        stored_version = record[1] if record else 0
+        if stored_version != version:
+            raise StaleStateError(
+                f"{kind} state {agreement_id} is at version {stored_version}, not {version}"
+            )
+        self._records[(kind, agreement_id)] = (
+            copy.deepcopy(data),
+            version + 1,
+            time.monotonic(),
+        )
+        return version + 1
+
+    async def delete(self, kind: str, agreement_id: int) -> None:
+        self._records.pop((kind, agreement_id), None)
+
+    async def delete_expired(self, max_age_seconds: int) -> int:
+        deadline = time.monotonic() - max_age_seconds
+        expired = [key for key, record in self._records.items() if record[2] < deadline]
+        for key in expired:
+            del self._records[key]
+        return len(expired)
+
+
+class PostgresStateStore(StateStore):
+    """Keeps the states in the AgreementStateRecord table so any worker can serve any agreement."""
+
+    @property
+    def db(self):
+        return conn_manager.db
+
+    async def load(self, kind: str, agreement_id: int) -> Optional[Tuple[dict, int]]:
+        record = await self.db.agreementstaterecord.find_unique(
+            where={"kind_agreementId": {"kind": kind, "agreementId": agreement_id}}
+        )
+        if record is None:
+            return None
+        return record.data, record.version
+
+    async def save(self, kind: str, agreement_id: int, data: dict, version: int) -> int:
+        if version == 0:
+            try:
+                await self.db.agreementstaterecord.create(
+                    data={
+                        "kind": kind,
+                        "agreementId": agreement_id,
+                        "data": Json(data),
+                        "version": 1,
+                    }
+                )
+            except UniqueViolationError:
+                raise StaleStateError(f"{kind} state {agreement_id} was already created")
+            return 1
+
+        # The version check and the write happen in one statement
+        updated = await self.db.agreementstaterecord.update_many(
+            where={"kind": kind, "agreementId": agreement_id, "version": version},
+            data={"data": Json(data), "version": version + 1},
+        )
+        if updated == 0:
+            raise StaleStateError(f"{kind} state {agreement_id} is no longer at version {version}")
+        return version + 1
+
+    async def delete(self, kind: str, agreement_id: int) -> None:
+        await self.db.agreementstaterecord.delete_many(
+            where={"kind": kind, "agreementId": agreement_id}
+        )
+
+    async def delete_expired(self, max_age_seconds: int) -> int:
+        deadline = datetime.now(timezone.utc) - timedelta(seconds=max_age_seconds)
+        return await self.db.agreementstaterecord.delete_many(
+            where={"updatedAt": {"lt": deadline}}
+        )
+
+
+def create_state_store(kind: str) -> StateStore:
+    if kind == "postgres":
+        return PostgresStateStore()
+    if kind == "memory":
+        return InMemoryStateStore()
+    raise ValueError(f"Unknown state store: {kind}")
+
+
+state_store = create_state_store(STATE_STORE)
@@ -0,0 +1,121 @@
+import asyncio
+import fnmatch
+import logging
+import os
+import time
+from typing import List, Optional
+from helpers.state_manager import state_manager
+from helpers.state_store import state_store
+from helpers.upload_store import upload_store
+from constants import STATE_SWEEP_INTERVAL_SECONDS, UPLOAD_DIR
+from config import STATE_TTL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Directories agreements write temporary files to, with the names they use there
+TEMP_FILE_LOCATIONS = [
+    # Uploaded photos and signatures
+    (UPLOAD_DIR, "*"),
+    # Draft and final PDFs from the generators' NamedTemporaryFile
+    (os.path.join(BACKEND_DIR, "helpers"), "tmp*.pdf"),
+    # Uploaded templates
+    (os.path.join(BACKEND_DIR, "services", "temp"), "*"),
+]
+
+
+def temp_files() -> List[str]:
+    paths = []
+    for directory, pattern in TEMP_FILE_LOCATIONS:
+        if not os.path.isdir(directory):
+            continue
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if fnmatch.fnmatch(name, pattern) and os.path.isfile(path):
+                paths.append(path)
+    return paths
+
+
+class StateSweeper:
+    """Evicts abandoned agreement states and deletes the temp files they left on disk."""
+
+    def __init__(
+        self,
+        interval_seconds: int = STATE_SWEEP_INTERVAL_SECONDS,
+        ttl_seconds: int = STATE_TTL_SECONDS,
+    ):
+        self.interval_seconds = interval_seconds
+        self.ttl_seconds = ttl_seconds
+        self._task = None
+        self.deleted_files = 0
+        self.expired_records = 0
+        self.expired_uploads = 0
+        self.last_sweep_at: Optional[float] = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._sweep_loop())
+
+    async def shutdown(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    async def _sweep_loop(self) -> None:
+        while True:
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error(f"State sweep failed: {str(e)}")
+            await asyncio.sleep(self.interval_seconds)
+
+    async def sweep(self) -> None:
+        for state in state_manager.evict_expired():
+            logger.info(f"Evicting abandoned state for agreement {state.agreement_id}")
+            for path in state.file_paths():
+                self._remove(path)
+
+        self.expired_records += await state_store.delete_expired(self.ttl_seconds)
+        self.expired_uploads += await upload_store.delete_expired(self.ttl_seconds)
+
+        # Files whose state was cleaned up without them, or never created one,
+        # are only found by age
+        deadline = time.time() - self.ttl_seconds
+        for path in temp_files():
+            try:
+                if os.path.getmtime(path) < deadline:
+                    self._remove(path)
+            except OSError:
+                # Deleted by its agreement since it was listed
+                continue
+        self.last_sweep_at = time.time()
+
+    def _remove(self, path: str) -> None:
+        try:
+            os.remove(path)
+            self.deleted_files += 1
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Could not delete temp file {path}: {str(e)}")
+
+    def stats(self) -> dict:
+        files = temp_files()
+        temp_bytes = 0
+        for path in files:
+            try:
+                temp_bytes += os.path.getsize(path)
+            except OSError:
+                continue
+        return {
+            **state_manager.stats(),
+            "temp_files": len(files),
+            "temp_file_bytes": temp_bytes,
+            "deleted_temp_files": self.deleted_files,
+            "expired_stored_states": self.expired_records,
+            "expired_stored_uploads": self.expired_uploads,
+            "last_sweep_at": self.last_sweep_at,
+        }
+
+
+state_sweeper = StateSweeper()
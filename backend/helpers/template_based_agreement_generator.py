@@ -1,16 +1,45 @@
+import asyncio
+import json
+import logging
+import re
 import tempfile
 from helpers.rent_agreement_generator import resize_image
-from constants import Model, CHAT_OPENAI_BASE_URL
+from constants import (
+    Model,
+    CHAT_OPENAI_BASE_URL,
+    CHUNK_MAX_RETRIES,
+    CHUNK_RETRY_DELAY,
+    SIGNATURE_ROLES_CONTEXT_CHARS,
+)
+from config import SIGNATURE_BLOCK, TEMPLATE_CHUNK_CONCURRENCY
 from langgraph.graph import StateGraph, START, END
 from langchain_openai import ChatOpenAI
 from langchain.memory import ConversationBufferMemory
 from helpers.state_manager import State, state_manager
-from helpers.agreement_generator_helper import extract_text_from_pdf, extract_fonts, create_pdf_file
+from helpers.cancellation import JobCancelledError, raise_if_cancelled
+from helpers.llm_client import http_async_client
+from helpers.thread_executer import execute_in_new_thread
+from helpers.agreement_generator_helper import (
+    extract_text_from_pdf,
+    extract_fonts,
+    create_pdf_file,
+    has_placeholders,
+    insert_signature_block,
+)
 from prompts import (
     SYSTEM_PROMPT_FOR_SIGNATURE_PLACEHOLDER,
     USER_PROMPT_FOR_SIGNATURE_PLACEHOLDER,
     SYSTEM_PROMPT_FOR_AGGREMENT_GENERATION,
+    SYSTEM_PROMPT_FOR_SIGNATURE_ROLES,
+)
+from tenacity import (
+    retry,
+    stop_after_attempt,
+    wait_fixed,
+    retry_if_exception_type,
+    retry_if_not_exception_type,
 )
+from typing import Dict, List
 import os
 
 os.environ["OPENAI_API_KEY"] = "XXX"
@@ -24,10 +53,19 @@ llm = ChatOpenAI(
     max_retries=2,
     api_key="",
     base_url=CHAT_OPENAI_BASE_URL,
+    http_async_client=http_async_client,
 )
 
+# Used when the LLM gives no usable roles for the signature block
+DEFAULT_SIGNATURE_ROLES = {
+    "authority_role": "Authority",
+    "authority_name": "",
+    "participant_role": "Participant",
+    "participant_name": "",
+}
 
-def add_signature(agreement_text: str):
+
+async def add_signature(agreement_text: str):
     messages = [
         {
             "role": "system",
@@ -41,10 +79,88 @@ def add_signature(agreement_text: str):
         },
     ]
 
-    return llm.invoke(messages)
+    return await llm.ainvoke(messages)
+
 
+async def get_signature_roles(template_chunks: List[str], messages: list) -> Dict[str, str]:
+    """Asks the LLM only for the signing parties' roles and names."""
+    template_text = "\n\n".join(template_chunks)
+    if len(template_text) > 2 * SIGNATURE_ROLES_CONTEXT_CHARS:
+        # The parties are named at the start and labelled again at the signatures
+        template_text = (
+            template_text[:SIGNATURE_ROLES_CONTEXT_CHARS]
+            + "\n\n...\n\n"
+            + template_text[-SIGNATURE_ROLES_CONTEXT_CHARS:]
+        )
+    system_msg = {
+        "role": "system",
+        "content": SYSTEM_PROMPT_FOR_SIGNATURE_ROLES.format(template_text=template_text),
+    }
+    raise_if_cancelled()
+    try:
+        response = await llm.ainvoke([system_msg] + messages)
+        roles = json.loads(re.search(r"\{.*\}", response.content, re.DOTALL).group(0))
+        return {
+            key: str(roles.get(key) or default).strip()
+            for key, default in DEFAULT_SIGNATURE_ROLES.items()
+        }
+    except JobCancelledError:
+        raise
+    except Exception as e:
+        # Generic roles still give a usable signature block
+        logging.info(f"Using default signature roles: {str(e)}")
+        return dict(DEFAULT_SIGNATURE_ROLES)
+
+
+def log_chunk_retry(retry_state):
+    logging.info(
+        f"Retry attempt {retry_state.attempt_number}: Retrying template chunk: "
+        f"{str(retry_state.outcome.exception())}"
+    )
+
+
+@retry(
+    stop=stop_after_attempt(CHUNK_MAX_RETRIES),
+    wait=wait_fixed(CHUNK_RETRY_DELAY),
+    # tenacity catches BaseException, so asyncio.CancelledError has to be left
+    # out too or a chunk cancelled by fill_chunks would call the LLM again
+    retry=retry_if_exception_type(Exception)
+    & retry_if_not_exception_type(JobCancelledError),
+    before_sleep=log_chunk_retry,
+    reraise=True,
+)
+async def fill_chunk(chunk: str, messages: list, semaphore: asyncio.Semaphore) -> str:
+    """Fills the placeholders of one template chunk, retrying it on its own."""
+    if not has_placeholders(chunk):
+        # Nothing to fill, so the LLM would only echo the chunk back
+        return chunk
+    system_msg = {
+        "role": "system",
+        "content": SYSTEM_PROMPT_FOR_AGGREMENT_GENERATION.format(template_text=chunk),
+    }
+    # The slot is given back between attempts so a failing chunk doesn't hold it
+    # through the retry delay
+    async with semaphore:
+        raise_if_cancelled()
+        response = await llm.ainvoke([system_msg] + messages)
+    if not response.content:
+        raise ValueError("Empty response from LLM")
+    return response.content
 
-def generate_agreement(state: State):
+
+async def fill_chunks(chunks: List[str], messages: list, concurrency: int) -> List[str]:
+    """Fills up to `concurrency` chunks at once and returns them in template order."""
+    semaphore = asyncio.Semaphore(concurrency)
+    tasks = [asyncio.ensure_future(fill_chunk(chunk, messages, semaphore)) for chunk in chunks]
+    try:
+        return await asyncio.gather(*tasks)
+    finally:
+        # A chunk that failed every attempt fails the document, so the rest stop
+        for task in tasks:
+            task.cancel()
+
+
+async def generate_agreement(state: State):
     agreement_id = state["agreement_id"]
     current_state = state_manager.get_template_agreement_state(agreement_id)
     if not current_state:
@@ -59,22 +175,33 @@ def generate_agreement(state: State):
     current_state.pdf_font_name = font_name
     current_state.pdf_font_file = font_file
 
-    generated_text = ""
-    for chunk in template_chunks:
-        system_msg = {
-            "role": "system",
-            "content": SYSTEM_PROMPT_FOR_AGGREMENT_GENERATION.format(
-                template_text=chunk
-            ),
-        }
-        messages = [system_msg] + state["messages"]
-        response = llm.invoke(messages)
-        generated_text += response.content + "\n"
+    logging.info(
+        f"Filling {sum(map(has_placeholders, template_chunks))} of {len(template_chunks)} "
+        f"template chunks for agreement {agreement_id}"
+    )
+    if SIGNATURE_BLOCK == "llm":
+        filled_chunks = await fill_chunks(
+            template_chunks, state["messages"], TEMPLATE_CHUNK_CONCURRENCY
+        )
+        generated_text = "".join(chunk + "\n" for chunk in filled_chunks)
+
+        raise_if_cancelled()
+        response_sign = await add_signature(generated_text)
+        current_state.agreement_text = response_sign.content
+
+        return {"messages": response_sign}
 
-    response_sign = add_signature(generated_text)
-    current_state.agreement_text = response_sign.content
+    # The roles only depend on the request and the template, so they are asked
+    # for while the chunks are being filled
+    filled_chunks, roles = await asyncio.gather(
+        fill_chunks(template_chunks, state["messages"], TEMPLATE_CHUNK_CONCURRENCY),
+        get_signature_roles(template_chunks, state["messages"]),
+    )
+    generated_text = "".join(chunk + "\n" for chunk in filled_chunks)
+    agreement_text = insert_signature_block(generated_text, roles)
+    current_state.agreement_text = agreement_text
 
-    return {"messages": response_sign}
+    return {"messages": agreement_text}
 
 
 def create_pdf(state: State):
@@ -136,10 +263,16 @@ def update_pdf_with_signatures(agreement_id: str):
     create_pdf_file(content, temp_pdf_path, current_state.pdf_font_name, current_state.pdf_font_file, False)
 
 
+async def render_pdf(state: State):
+    # PDF rendering blocks, so it runs in the thread pool while the LLM calls
+    # stay on the event loop
+    return await execute_in_new_thread(create_pdf, state)
+
+
 # Build graph
 graph_builder = StateGraph(State)
 graph_builder.add_node("generate", generate_agreement)
-graph_builder.add_node("create_pdf", create_pdf)
+graph_builder.add_node("create_pdf", render_pdf)
 graph_builder.add_edge(START, "generate")
 graph_builder.add_edge("generate", "create_pdf")
 graph_builder.add_edge("create_pdf", END)
@@ -1,10 +1,13 @@
 import asyncio
+import contextvars
 from concurrent.futures import ThreadPoolExecutor
 
 thread_pool = ThreadPoolExecutor(max_workers=10)
 
 
 async def execute_in_new_thread(function, *params):
+    # Carry context variables such as the job's cancel event into the thread
+    context = contextvars.copy_context()
     return await asyncio.get_event_loop().run_in_executor(
-        thread_pool, lambda: function(*params)
+        thread_pool, lambda: context.run(function, *params)
     )
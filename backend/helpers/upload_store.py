@@ -0,0 +1,134 @@
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+from prisma import Base64
+from config import STATE_STORE
+from constants import UPLOAD_DIR
+from database.connection import conn_manager
+
+
+class UploadStore:
+    """Photos and signatures uploaded by the parties, kept where every worker can read them.
+
+    The approval request is handled by whichever worker the party's link lands
+    on, while the PDF is built by the worker running the job, so the files
+    written to the approving worker's disk are also stored here by name.
+    """
+
+    async def save(self, kind: str, agreement_id: int, name: str, data: bytes) -> None:
+        raise NotImplementedError
+
+    async def load(self, kind: str, agreement_id: int, name: str) -> Optional[bytes]:
+        """Returns the stored upload, or None if there is none."""
+        raise NotImplementedError
+
+    async def delete(self, kind: str, agreement_id: int) -> None:
+        """Deletes every upload of the agreement."""
+        raise NotImplementedError
+
+    async def delete_expired(self, max_age_seconds: int) -> int:
+        """Deletes the uploads stored more than max_age_seconds ago and returns how many."""
+        raise NotImplementedError
+
+
+class InMemoryUploadStore(UploadStore):
+    """Keeps the uploads in the current process only, for tests and single-worker runs."""
+
+    def __init__(self):
+        # (kind, agreement_id, name) -> (data, monotonic time it was saved)
+        self._uploads: Dict[Tuple[str, int, str], Tuple[bytes, float]] = {}
+
+    async def save(self, kind: str, agreement_id: int, name: str, data: bytes) -> None:
+        self._uploads[(kind, agreement_id, name)] = (data, time.monotonic())
+
+    async def load(self, kind: str, agreement_id: int, name: str) -> Optional[bytes]:
+        upload = self._uploads.get((kind, agreement_id, name))
+        return upload[0] if upload else None
+
+    async def delete(self, kind: str, agreement_id: int) -> None:
+        for key in [key for key in self._uploads if key[:2] == (kind, agreement_id)]:
+            del self._uploads[key]
+
+    async def delete_expired(self, max_age_seconds: int) -> int:
+        deadline = time.monotonic() - max_age_seconds
+        expired = [key for key, upload in self._uploads.items() if upload[1] < deadline]
+        for key in expired:
+            del self._uploads[key]
+        return len(expired)
+
+
+class PostgresUploadStore(UploadStore):
+    """Keeps the uploads in the AgreementUpload table next to the shared agreement states."""
+
+    @property
+    def db(self):
+        return conn_manager.db
+
+    async def save(self, kind: str, agreement_id: int, name: str, data: bytes) -> None:
+        await self.db.agreementupload.create(
+            data={
+                "kind": kind,
+                "agreementId": agreement_id,
+                "name": name,
+                "data": Base64.encode(data),
+            }
+        )
+
+    async def load(self, kind: str, agreement_id: int, name: str) -> Optional[bytes]:
+        upload = await self.db.agreementupload.find_unique(
+            where={
+                "kind_agreementId_name": {
+                    "kind": kind,
+                    "agreementId": agreement_id,
+                    "name": name,
+                }
+            }
+        )
+        return upload.data.decode() if upload else None
+
+    async def delete(self, kind: str, agreement_id: int) -> None:
+        await self.db.agreementupload.delete_many(
+            where={"kind": kind, "agreementId": agreement_id}
+        )
+
+    async def delete_expired(self, max_age_seconds: int) -> int:
+        deadline = datetime.now(timezone.utc) - timedelta(seconds=max_age_seconds)
+        return await self.db.agreementupload.delete_many(
+            where={"createdAt": {"lt": deadline}}
+        )
+
+
+def create_upload_store(kind: str) -> UploadStore:
+    # Uploads are only useful to workers that share the agreement states
+    if kind == "postgres":
+        return PostgresUploadStore()
+    if kind == "memory":
+        return InMemoryUploadStore()
+    raise ValueError(f"Unknown upload store: {kind}")
+
+
+upload_store = create_upload_store(STATE_STORE)
+
+
+async def store_upload(kind: str, agreement_id: int, path: str) -> None:
+    """Stores a file just written to UPLOAD_DIR under its file name."""
+    if not path:
+        return
+    with open(path, "rb") as upload_file:
+        data = upload_file.read()
+    await upload_store.save(kind, agreement_id, os.path.basename(path), data)
+
+
+async def restore_uploads(kind: str, agreement_id: int, paths: List[str]) -> None:
+    """Writes the stored uploads missing from this worker's disk back to their paths."""
+    for path in paths:
+        # Approved fields without an upload hold placeholder text instead of a path
+        if not path or os.path.dirname(path) != UPLOAD_DIR or os.path.isfile(path):
+            continue
+        data = await upload_store.load(kind, agreement_id, os.path.basename(path))
+        if data is None:
+            continue
+        os.makedirs(UPLOAD_DIR, exist_ok=True)
+        with open(path, "wb") as upload_file:
+            upload_file.write(data)
@@ -1,11 +1,11 @@
 import asyncio
 from datetime import datetime
-import websockets
-import json
 import os
 import logging
-from helpers.state_manager import state_manager
-from config import WEBSOCKET_URL
+from helpers.state_manager import RENT_STATE, TEMPLATE_STATE, state_manager
+from helpers.upload_store import restore_uploads
+from helpers.approval_bus import approval_bus
+from api.routes.websocket import agreement_channel
 from enum import Enum
 
 
@@ -17,6 +17,10 @@ class ConnectionClosedError(Exception):
     pass
 
 
+class MissingUploadError(Exception):
+    """Raised when an approval's photo or signature is in neither this worker's disk nor the upload store."""
+
+
 class ApprovalResult(Enum):
     APPROVED = "approved"
     REJECTED = "rejected"
@@ -28,6 +32,96 @@ class ApprovalResult(Enum):
 logging.basicConfig(level=logging.INFO)
 
 
+def approved_upload(path: str, placeholder: str) -> str:
+    """Returns the upload to put in the PDF, or the placeholder when the party uploaded none.
+
+    An upload that was recorded but cannot be read fails the approval instead
+    of being replaced, so a signed PDF never silently lacks a signature.
+    """
+    if not path:
+        return placeholder
+    if not os.path.isfile(path):
+        raise MissingUploadError(f"Uploaded file {path} is not available on this worker")
+    return path
+
+
+def record_template_approval(current_template_state, data: dict) -> bool:
+    """Applies an approval event to the template state, returning False on a rejection."""
+    user_id = data.get("user_id")
+    if user_id == current_template_state.participant_id:
+        current_template_state.participant_approved = data.get("approved", False)
+        if current_template_state.participant_approved:
+            current_template_state.participant_signature = approved_upload(
+                current_template_state.participant_signature,
+                f"APPROVED BY PARTICIPANT - {datetime.now()}",
+            )
+            print("Participant has approved!")
+        else:
+            print("Participant has rejected!")
+            return False
+
+    elif user_id == current_template_state.authority_id:
+        current_template_state.authority_approved = data.get("approved", False)
+        if current_template_state.authority_approved:
+            current_template_state.authority_signature = approved_upload(
+                current_template_state.authority_signature,
+                f"APPROVED BY AUTHORITY - {datetime.now()}",
+            )
+            print("Authority has approved!")
+        else:
+            print("Authority has rejected!")
+            return False
+    return True
+
+
+def record_rent_approval(current_state, data: dict) -> bool:
+    """Applies an approval event to the rent state, returning False on a rejection."""
+    user_id = data.get("user_id")
+    if user_id in current_state.tenants:
+        tenant = current_state.tenants[user_id]
+        tenant.approved = data.get("approved", False)
+        if tenant.approved:
+            logging.info(
+                f"Tenant {tenant.name} ({user_id}) has approved the agreement."
+            )
+            tenant.signature = approved_upload(
+                tenant.signature, f"APPROVED BY {tenant.name} - {datetime.now()}"
+            )
+            tenant.photo = approved_upload(tenant.photo, f"{tenant.name}")
+        else:
+            logging.warning(f"Tenant {user_id} has rejected!")
+            return False
+
+    elif user_id == current_state.owner_id:
+        current_state.owner_approved = data.get("approved", False)
+        if current_state.owner_approved:
+            logging.info(
+                f"Owner {current_state.owner_name} ({user_id}) has approved the agreement."
+            )
+            current_state.owner_signature = approved_upload(
+                current_state.owner_signature,
+                f"APPROVED BY {current_state.owner_name} - {datetime.now()}",
+            )
+            current_state.owner_photo = approved_upload(
+                current_state.owner_photo, f"{current_state.owner_name}"
+            )
+        else:
+            logging.warning("Owner has rejected!")
+            return False
+    return True
+
+
+async def restore_approval_uploads(agreement_id: int, is_template: bool) -> None:
+    if is_template:
+        kind = TEMPLATE_STATE
+        state = await state_manager.load_template_agreement_state(agreement_id)
+    else:
+        kind = RENT_STATE
+        state = await state_manager.load_agreement_state(agreement_id)
+    if state is not None:
+        await restore_uploads(kind, agreement_id, state.upload_paths())
+
+
 async def listen_for_approval(
     timeout_seconds: int = 300, is_template: bool = False, agreement_id: str = None
 ) -> ApprovalResult:
@@ -41,146 +135,57 @@ async def listen_for_approval(
     Raises:
         ApprovalTimeoutError: If no response received within timeout period
     """
+    # Subscribing happens before the first await so no event published after
+    # the approval emails went out can be missed
+    channel = agreement_channel(agreement_id, is_template)
+    queue = approval_bus.subscribe(channel)
     try:
-        async with websockets.connect(WEBSOCKET_URL) as websocket:
-            while True:
-                try:
-                    # Set timeout for receiving messages
-                    response = await asyncio.wait_for(
-                        websocket.recv(), timeout=timeout_seconds
+        while True:
+            try:
+                # Set timeout for receiving messages
+                data = await asyncio.wait_for(queue.get(), timeout=timeout_seconds)
+                logging.info(f"Received approval response: {data}")
+
+                # The approving worker stored the uploads in the shared state and
+                # the upload store, so their files are fetched before each event
+                # is applied on top of the latest stored version
+                await restore_approval_uploads(agreement_id, is_template)
+                if is_template:
+                    approved = await state_manager.update_template_agreement_state(
+                        agreement_id, lambda state: record_template_approval(state, data)
+                    )
+                    current_state = state_manager.get_template_agreement_state(
+                        agreement_id
                     )
-                    data = json.loads(response)
-                    logging.info(f"Received approval response: {data}")
+                else:
+                    approved = await state_manager.update_agreement_state(
+                        agreement_id, lambda state: record_rent_approval(state, data)
+                    )
+                    current_state = state_manager.get_agreement_state(agreement_id)
+
+                if not approved:
+                    return ApprovalResult.REJECTED
 
-                    user_id = data.get("user_id")
+                # Check if both parties have responded
+                if current_state.is_fully_approved():
                     if is_template:
-                        current_template_state = (
-                            state_manager.get_template_agreement_state(agreement_id)
+                        logging.info(
+                            "Agreement successfully approved by Authority and Participant."
                         )
-                        if user_id == current_template_state.participant_id:
-                            current_template_state.participant_approved = data.get(
-                                "approved", False
-                            )
-                            if current_template_state.participant_approved:
-                                participant_signature_path = (
-                                    current_template_state.participant_signature
-                                )
-                                if os.path.isfile(participant_signature_path):
-                                    current_template_state.participant_signature = (
-                                        participant_signature_path
-                                    )
-                                else:
-                                    current_template_state.participant_signature = (
-                                        f"APPROVED BY PARTICIPANT - {datetime.now()}"
-                                    )
-                                print("Participant has approved!")
-                            else:
-                                print("Participant has rejected!")
-                                return ApprovalResult.REJECTED
-
-                        elif user_id == current_template_state.authority_id:
-                            current_template_state.authority_approved = data.get(
-                                "approved", False
-                            )
-                            if current_template_state.authority_approved:
-                                authority_signature_path = (
-                                    current_template_state.authority_signature
-                                )
-                                if os.path.isfile(authority_signature_path):
-                                    current_template_state.authority_signature = (
-                                        authority_signature_path
-                                    )
-                                else:
-                                    current_template_state.authority_signature = (
-                                        f"APPROVED BY AUTHORITY - {datetime.now()}"
-                                    )
-                                print("Authority has approved!")
-                            else:
-                                print("Authority has rejected!")
-                                return ApprovalResult.REJECTED
-                    else:
-                        current_state = state_manager.get_agreement_state(agreement_id)
-                        if user_id in current_state.tenants:
-                            current_state.tenants[user_id] = data.get("approved", False)
-                            if current_state.tenants[user_id]:
-                                tenant_name = current_state.tenant_names[user_id]
-                                logging.info(
-                                    f"Tenant {tenant_name} ({user_id}) has approved the agreement."
-                                )
-                                tenant_signature_path = current_state.tenant_signatures[
-                                    user_id
-                                ]
-                                if os.path.isfile(tenant_signature_path):
-                                    current_state.tenant_signatures[user_id] = (
-                                        tenant_signature_path
-                                    )
-                                else:
-                                    current_state.tenant_signatures[user_id] = (
-                                        f"APPROVED BY {tenant_name} - {datetime.now()}"
-                                    )
-
-                                tenant_photo_path = current_state.tenant_photos[user_id]
-                                if os.path.isfile(tenant_photo_path):
-                                    current_state.tenant_photos[user_id] = (
-                                        tenant_photo_path
-                                    )
-                                else:
-                                    current_state.tenant_photos[user_id] = (
-                                        f"{tenant_name}"
-                                    )
-                            else:
-                                logging.warning(f"Tenant {user_id} has rejected!")
-                                return ApprovalResult.REJECTED
-
-                        elif user_id == current_state.owner_id:
-                            current_state.owner_approved = data.get("approved", False)
-                            if current_state.owner_approved:
-                                logging.info(
-                                    f"Owner {current_state.owner_name} ({user_id}) has approved the agreement."
-                                )
-                                owner_signature_path = current_state.owner_signature
-                                if os.path.exists(owner_signature_path):
-                                    current_state.owner_signature = owner_signature_path
-                                else:
-                                    current_state.owner_signature = f"APPROVED BY {current_state.owner_name} - {datetime.now()}"
-
-                                owner_photo_path = current_state.owner_photo
-                                if os.path.exists(owner_photo_path):
-                                    current_state.owner_photo = owner_photo_path
-                                else:
-                                    current_state.owner_photo = (
-                                        f"{current_state.owner_name}"
-                                    )
-                            else:
-                                logging.warning("Owner has rejected!")
-                                return ApprovalResult.REJECTED
-
-                    # Check if both parties have responded
-                    if is_template:
-                        if current_template_state.is_fully_approved():
-                            logging.info(
-                                "Agreement successfully approved by Authority and Participant."
-                            )
-                            return ApprovalResult.APPROVED
                     else:
-                        if current_state.is_fully_approved():
-                            logging.info(
-                                "Agreement successfully approved by Owner and Tenants."
-                            )
-                            return ApprovalResult.APPROVED
-
-                except asyncio.TimeoutError:
-                    logging.error("Approval process timed out")
-                    return ApprovalResult.EXPIRED
-                except json.JSONDecodeError as e:
-                    logging.error(f"Invalid JSON received: {e}")
-                    continue
-    except websockets.exceptions.ConnectionClosed:
-        logging.error("WebSocket connection closed unexpectedly")
-        return ApprovalResult.CONNECTION_CLOSED
-    except websockets.exceptions.WebSocketException as e:
-        logging.error(f"WebSocket error: {str(e)}")
+                        logging.info(
+                            "Agreement successfully approved by Owner and Tenants."
+                        )
+                    return ApprovalResult.APPROVED
+
+            except asyncio.TimeoutError:
+                logging.error("Approval process timed out")
+                return ApprovalResult.EXPIRED
+    except MissingUploadError as e:
+        logging.error(f"Approval could not be applied: {str(e)}")
         return ApprovalResult.CONNECTION_CLOSED
     except Exception as e:
         logging.error(f"Unexpected error: {str(e)}")
         return ApprovalResult.CONNECTION_CLOSED
+    finally:
+        approval_bus.unsubscribe(channel)
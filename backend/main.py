@@ -6,20 +6,34 @@ from api.routes.agreement import router as agreement_router
 from api.routes.user import router as user_router
 from api.routes.validation import router as image_validation_router
 from api.routes.contact_us import router as contact_router
+from api.routes.metrics import router as metrics_router
 import uvicorn
 import os
 from contextlib import asynccontextmanager
 from database.connection import conn_manager
 from helpers.thread_executer import thread_pool
+from auth.clerk_auth import close_async_client
+from helpers.llm_client import close_http_async_client
+from helpers.backplane import backplane
+from helpers.job_manager import job_manager
+from helpers.state_sweeper import state_sweeper
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     await conn_manager.connect()
+    await backplane.start()
+    job_manager.start(conn_manager.db)
+    state_sweeper.start()
     try:
         yield
     finally:
+        await state_sweeper.shutdown()
+        await job_manager.shutdown()
+        await backplane.stop()
         await conn_manager.disconnect()
+        await close_async_client()
+        await close_http_async_client()
         thread_pool.shutdown(wait=True)
 
 
@@ -43,6 +57,7 @@ app.include_router(agreement_router)
 app.include_router(user_router)
 app.include_router(image_validation_router)
 app.include_router(contact_router)
+app.include_router(metrics_router)
 
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
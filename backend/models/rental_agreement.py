@@ -1,6 +1,6 @@
 from pydantic import BaseModel
 from datetime import datetime
-from typing import List, Dict
+from typing import List, Dict, Optional
 
 
 class AgreementRequest(BaseModel):
@@ -20,3 +20,4 @@ class AgreementRequest(BaseModel):
     furniture_and_appliances: List[Dict[str, str]]
     amenities: List[str]
     user_id: str
+    priority: Optional[int] = 0
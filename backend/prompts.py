@@ -65,6 +65,22 @@ USER_PROMPT_FOR_SIGNATURE_PLACEHOLDER = (
     "Generate the agreement and return only the whole agreement text without any extra text"
 )
 
+SYSTEM_PROMPT_FOR_SIGNATURE_ROLES = """
+    Your task is to name the two signing parties of an agreement for its signature section.
+
+    ## AGREEMENT TEMPLATE (opening and closing)  
+    {template_text}
+
+    ## RULES  
+    - Identify the agreement type (e.g., Rental Agreement, Offer Letter, Consulting Agreement).  
+    - The authority is the higher authority (e.g., Owner, Manager, Client).  
+    - The participant is the lower authority (e.g., Tenant, Candidate, Consultant).  
+    - Take the names from the user's request, or from the template if it already has them. Leave a name empty if neither has it.  
+    - Return only a JSON object with the keys "authority_role", "authority_name", "participant_role" and "participant_name", without any extra text.  
+    - Example for a rental agreement:  
+      {{"authority_role": "Owner", "authority_name": "John", "participant_role": "Tenant", "participant_name": "Jimmy"}}
+"""
+
 SYSTEM_PROMPT_FOR_AGGREMENT_GENERATION = """
     You are an AI assistant responsible for generating structured agreements based on a provided template.  
     Your task is to accurately replace placeholders while maintaining the original document structure and formatting.
@@ -1,7 +1,10 @@
+import asyncio
 import logging
 import shutil
 import os
 from helpers.thread_executer import execute_in_new_thread
+from helpers.generation_limiter import generation_limiter
+from helpers.cancellation import JobCancelledError, owns_shared_state, raise_if_cancelled
 from helpers.db_operations import create_user_agreement_status, update_agreement_status, store_final_pdf
 from helpers.email_helper import send_email_with_attachment
 from helpers.websocket_helper import (
@@ -17,25 +20,33 @@ from helpers.state_manager import state_manager
 from fastapi import HTTPException
 from pydantic import BaseModel
 import os
-from tenacity import retry, stop_after_attempt, wait_fixed, retry_if_exception_type
-from constants import MAX_RETRIES, RETRY_DELAY
+from tenacity import (
+    retry,
+    stop_after_attempt,
+    wait_fixed,
+    retry_if_exception_type,
+    retry_if_not_exception_type,
+)
+from constants import MAX_RETRIES, RETRY_DELAY, UPLOAD_DIR
+from config import GENERATION_PIPELINE
 from datetime import datetime
 import base64
 from prisma.enums import AgreementStatus
-from typing import List, Dict
+from typing import Awaitable, Callable, List, Dict
 from prompts import PREFIX, FORMAT_INSTRUCTIONS, SUFFIX
 import uuid
 from models.rental_agreement import AgreementRequest
+from helpers.job_manager import job_manager
 
 logging.basicConfig(level=logging.INFO)
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 
-def run_agreement_tool(user_input: str, agreement_id: int) -> str:
+async def run_agreement_tool(user_input: str, agreement_id: int) -> str:
     state = {
         "messages": [("user", user_input)],
         "agreement_id": agreement_id
     }
-    for event in graph.stream(state):
+    async for event in graph.astream(state):
         if "create_pdf" in event:
             output = event["create_pdf"].get("messages", "No messages found")
             return output
@@ -47,7 +58,8 @@ def create_tool_with_agreement_id(agreement_id):
     return [
         Tool(
             name="generate_agreement",
-            func=lambda user_input: run_agreement_tool(user_input, agreement_id),
+            func=None,
+            coroutine=lambda user_input: run_agreement_tool(user_input, agreement_id),
             description="Generate a rental agreement PDF from the provided details. Output only the agreement text.",
         )
     ]
@@ -75,8 +87,8 @@ def delete_temp_images(current_state):
     ]
     
     # Add tenant photos and signatures
-    files_to_delete.extend(current_state.tenant_photos.values())
-    files_to_delete.extend(current_state.tenant_signatures.values())
+    for tenant in current_state.tenants.values():
+        files_to_delete.extend([tenant.photo, tenant.signature])
 
     for file_path in files_to_delete:
         if file_path and os.path.exists(file_path):
@@ -97,7 +109,7 @@ def save_base64_image(photo_data: str, user_id: str, is_signature: bool = False)
         return ""
 
     photo_bytes = base64.b64decode(photo_data)
-    save_dir = "./utils"
+    save_dir = UPLOAD_DIR
     os.makedirs(save_dir, exist_ok=True)
 
     unique_id = uuid.uuid4().hex
@@ -144,33 +156,32 @@ def log_after_failure(retry_state):
 @retry(
     stop=stop_after_attempt(MAX_RETRIES),
     wait=wait_fixed(RETRY_DELAY),
-    retry=retry_if_exception_type(Exception),
+    # A cancelled job stops instead of being retried
+    retry=retry_if_exception_type(Exception)
+    & retry_if_not_exception_type(JobCancelledError),
     before_sleep=log_before_retry,
     after=log_after_failure,
 )
 
-def generate_agreement_with_retry(agent, agreement_details, agreement_id):
+async def generate_agreement_with_retry(generate, agreement_details, agreement_id):
+    raise_if_cancelled()
     try:
-        response = agent.invoke(agreement_details)
+        response = await generate(agreement_details)
         if not response:
             raise ValueError("Empty response from LLM")
         return response
+    except JobCancelledError:
+        raise
     except Exception as e:
-        logging.info(f"Error while invoking agent for agreement_id {agreement_id}: {str(e)}")
+        logging.info(f"Error while generating agreement_id {agreement_id}: {str(e)}")
         return None
 
-async def create_agreement_details(
-    request: AgreementRequest, agreement_id: int, db: object
-):
-    try:
-        state_manager.set_current_agreement_id(agreement_id)
-        current_state = state_manager.get_agreement_state(agreement_id)
-        current_state.set_owner(request.owner_name, request.owner_email)
-        current_state.set_agreement_details(request)
-        tools = create_tool_with_agreement_id(agreement_id)
 
+def create_agreement_generator(agreement_id: int) -> Callable[[str], Awaitable[object]]:
+    """Returns the callable that turns the formatted request into the agreement PDF."""
+    if GENERATION_PIPELINE == "agent":
         agent = initialize_agent(
-            tools=tools,
+            tools=create_tool_with_agreement_id(agreement_id),
             llm=llm,
             agent=AgentType.ZERO_SHOT_REACT_DESCRIPTION,
             verbose=True,
@@ -184,14 +195,34 @@ async def create_agreement_details(
                 "prompt": prompt,
             },
         )
+        return agent.ainvoke
 
+    # The request is already structured, so the graph runs on it directly instead
+    # of paying for an agent round trip that can only decide to call it
+    return lambda agreement_details: run_agreement_tool(agreement_details, agreement_id)
+
+async def create_agreement_details(
+    request: AgreementRequest, agreement_id: int, db: object
+):
+    # Set before the first await, which a cancel can interrupt
+    current_state = None
+    tenants = []
+    release_state = True
+    try:
+        # A reclaimed job restarts from scratch: whatever the interrupted attempt
+        # left behind is dropped, including the parties its emailed links point to
+        await state_manager.cleanup_agreement_state(agreement_id)
+        current_state = state_manager.get_agreement_state(agreement_id)
+        current_state.set_owner(request.owner_name, request.owner_email)
+        current_state.set_agreement_details(request)
+        generate = create_agreement_generator(agreement_id)
 
         # Store tenant details
-        tenants = []
         for tenant in request.tenant_details:
             tenant_id = current_state.add_tenant(
                 tenant["email"],
                 tenant["name"],
+                tenant.get("address", ""),
             )
             tenants.append((tenant_id, tenant["email"]))
 
@@ -213,9 +244,12 @@ async def create_agreement_details(
         )
 
         try:
-            response = await execute_in_new_thread(
-                generate_agreement_with_retry, agent, agreement_details, agreement_id
-            )
+            async with generation_limiter.slot():
+                response = await generate_agreement_with_retry(
+                    generate, agreement_details, agreement_id
+                )
+        except JobCancelledError:
+            raise
         except Exception as e:
             await update_agreement_status(db, agreement_id, AgreementStatus.FAILED)
             raise HTTPException(
@@ -223,6 +257,10 @@ async def create_agreement_details(
                 detail=f"Error generating agreement after {MAX_RETRIES} attempts: {str(e)}",
             )
 
+        # The approval links can land on any worker, so the parties must be
+        # visible in the shared store before the emails go out
+        await state_manager.save_agreement_state(current_state)
+
         owner_success, _ = send_email_with_attachment(
             request.owner_email, current_state.pdf_file_path, "owner", agreement_id, False
         )
@@ -245,10 +283,10 @@ async def create_agreement_details(
                 if approval_result == ApprovalResult.APPROVED:
                     # Mark as approved and generate final PDF with signatures
                     current_state.owner_approved = True
-                    for tenant_id in current_state.tenants:
-                        current_state.tenants[tenant_id] = True
+                    for tenant in current_state.tenants.values():
+                        tenant.approved = True
                     # Generate final PDF with signatures and get the path
-                    create_pdf(current_state)
+                    await execute_in_new_thread(create_pdf, current_state)
                     final_pdf_path = current_state.pdf_file_path
 
                     # Send final agreement with replaced signatures/photos
@@ -263,7 +301,7 @@ async def create_agreement_details(
                     await store_final_pdf(db, agreement_id, current_state.pdf_file_path)
                     delete_temp_file(current_state)
                     delete_temp_images(current_state)
-                    state_manager.cleanup_agreement_state(agreement_id)
+                    await state_manager.cleanup_agreement_state(agreement_id)
                     return {
                         "message": "Final signed agreement with signatures sent to all parties!"
                     }
@@ -276,7 +314,7 @@ async def create_agreement_details(
 
                     delete_temp_file(current_state)
                     delete_temp_images(current_state)
-                    state_manager.cleanup_agreement_state(agreement_id)
+                    await state_manager.cleanup_agreement_state(agreement_id)
                     return {"message": "Agreement was rejected by one or more parties."}
 
                 elif approval_result == ApprovalResult.EXPIRED:
@@ -288,7 +326,7 @@ async def create_agreement_details(
 
                     delete_temp_file(current_state)
                     delete_temp_images(current_state)
-                    state_manager.cleanup_agreement_state(agreement_id)
+                    await state_manager.cleanup_agreement_state(agreement_id)
                     return {
                         "message": "Agreement was expired due to no action taken by one or more parties within 5 minutes."
                     }
@@ -302,7 +340,7 @@ async def create_agreement_details(
 
                     delete_temp_file(current_state)
                     delete_temp_images(current_state)
-                    state_manager.cleanup_agreement_state(agreement_id)
+                    await state_manager.cleanup_agreement_state(agreement_id)
                     return {
                         "message": "Agreement process failed due to connection issues."
                     }
@@ -316,7 +354,7 @@ async def create_agreement_details(
 
                 delete_temp_file(current_state)
                 delete_temp_images(current_state)
-                state_manager.cleanup_agreement_state(agreement_id)
+                await state_manager.cleanup_agreement_state(agreement_id)
                 return {
                     "message": "Agreement process failed: Connection closed unexpectedly"
                 }
@@ -324,14 +362,33 @@ async def create_agreement_details(
             await update_agreement_status(db, agreement_id, AgreementStatus.FAILED)
             return {"message": "Error sending initial agreement emails."}
 
+    except (asyncio.CancelledError, JobCancelledError):
+        # A user cancel already marked the row CANCELLED. On a lost lease or a
+        # shutdown the job is reclaimed and its new run uses the shared state
+        release_state = owns_shared_state()
+        if current_state is not None and release_state:
+            delete_temp_file(current_state)
+        raise
     except Exception as e:
         await update_agreement_status(db, agreement_id, AgreementStatus.FAILED)
-        await create_user_agreement_status(db, current_state.owner_id, agreement_id, AgreementStatus.FAILED)
+        if current_state is not None:
+            await create_user_agreement_status(db, current_state.owner_id, agreement_id, AgreementStatus.FAILED)
         for tenant_id, _ in tenants:
             await create_user_agreement_status(db, tenant_id, agreement_id, AgreementStatus.FAILED)
         raise HTTPException(
             status_code=500, detail=f"An unexpected error occurred: {str(e)}"
         )
     finally:
-        delete_temp_images(current_state)
-        state_manager.cleanup_agreement_state(agreement_id)
+        if release_state:
+            if current_state is not None:
+                delete_temp_images(current_state)
+            await state_manager.cleanup_agreement_state(agreement_id)
+
+
+async def run_agreement_job(job, db):
+    """Runs a queued rent agreement job from its stored request."""
+    request = AgreementRequest(**job.payload)
+    return await create_agreement_details(request, job.agreementId, db)
+
+
+job_manager.register("rent", run_agreement_job)
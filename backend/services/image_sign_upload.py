@@ -1,4 +1,5 @@
-from helpers.state_manager import state_manager
+from helpers.state_manager import RENT_STATE, TEMPLATE_STATE, state_manager
+from helpers.upload_store import store_upload
 from services.doc_agent import save_base64_image
 from pydantic import BaseModel
 from typing import Optional
@@ -13,43 +14,84 @@ class Data(BaseModel):
 
 
 async def image_and_sign_upload(agreement: Data):
-    current_state = state_manager.get_agreement_state(agreement.agreement_id)
+    # The uploads are written to the shared state and their files to the upload
+    # store, since the agreement may be waiting for approvals on another worker
+    current_state = await state_manager.load_agreement_state(agreement.agreement_id)
+    if current_state is None:
+        return
     if agreement.user == current_state.owner_id:
-        current_state.owner_photo = save_base64_image(
+        owner_photo_path = save_base64_image(
             agreement.imageUrl, current_state.owner_name
         )
-        current_state.owner_signature = save_base64_image(
+        owner_signature_path = save_base64_image(
             agreement.signature, current_state.owner_name, is_signature=True
         )
 
-    elif agreement.user in current_state.tenants.keys():
-        tenant_photo_path = save_base64_image(
-            agreement.imageUrl, current_state.tenant_names[agreement.user]
+        await store_upload(RENT_STATE, agreement.agreement_id, owner_photo_path)
+        await store_upload(RENT_STATE, agreement.agreement_id, owner_signature_path)
+
+        def set_owner_uploads(state):
+            state.owner_photo = owner_photo_path
+            state.owner_signature = owner_signature_path
+
+        await state_manager.update_agreement_state(
+            agreement.agreement_id, set_owner_uploads
         )
+
+    elif agreement.user in current_state.tenants.keys():
+        tenant_name = current_state.tenants[agreement.user].name
+        tenant_photo_path = save_base64_image(agreement.imageUrl, tenant_name)
         tenant_signature_path = save_base64_image(
-            agreement.signature,
-            current_state.tenant_names[agreement.user],
-            is_signature=True,
+            agreement.signature, tenant_name, is_signature=True
         )
-        current_state.update_tenant(
-            tenant_signature_path, tenant_photo_path, agreement.user
+        await store_upload(RENT_STATE, agreement.agreement_id, tenant_photo_path)
+        await store_upload(RENT_STATE, agreement.agreement_id, tenant_signature_path)
+        await state_manager.update_agreement_state(
+            agreement.agreement_id,
+            lambda state: state.update_tenant(
+                tenant_signature_path, tenant_photo_path, agreement.user
+            ),
         )
 
 
 async def image_and_sign_upload_for_template(agreement: Data):
-    current_template_state = state_manager.get_template_agreement_state(
+    current_template_state = await state_manager.load_template_agreement_state(
         agreement.agreement_id
     )
+    if current_template_state is None:
+        return
     if agreement.user == current_template_state.authority_id:
-        current_template_state.authority_signature = save_base64_image(
+        authority_signature_path = save_base64_image(
             agreement.signature,
             current_template_state.authority_email,
             is_signature=True,
         )
 
+        await store_upload(
+            TEMPLATE_STATE, agreement.agreement_id, authority_signature_path
+        )
+
+        def set_authority_signature(state):
+            state.authority_signature = authority_signature_path
+
+        await state_manager.update_template_agreement_state(
+            agreement.agreement_id, set_authority_signature
+        )
+
     elif agreement.user == current_template_state.participant_id:
-        current_template_state.participant_signature = save_base64_image(
+        participant_signature_path = save_base64_image(
             agreement.signature,
             current_template_state.participant_email,
             is_signature=True,
         )
+
+        await store_upload(
+            TEMPLATE_STATE, agreement.agreement_id, participant_signature_path
+        )
+
+        def set_participant_signature(state):
+            state.participant_signature = participant_signature_path
+
+        await state_manager.update_template_agreement_state(
+            agreement.agreement_id, set_participant_signature
+        )
@@ -1,5 +1,8 @@
+import asyncio
 import logging
 from helpers.thread_executer import execute_in_new_thread
+from helpers.generation_limiter import generation_limiter
+from helpers.cancellation import JobCancelledError, owns_shared_state, raise_if_cancelled
 from helpers.db_operations import (
     create_user_agreement_status,
     store_final_pdf,
@@ -23,11 +26,19 @@ from helpers.state_manager import state_manager
 from fastapi import HTTPException
 import os
 from pydantic import BaseModel
-import shutil
-from tenacity import retry, stop_after_attempt, wait_fixed, retry_if_exception_type
+from tenacity import (
+    retry,
+    stop_after_attempt,
+    wait_fixed,
+    retry_if_exception_type,
+    retry_if_not_exception_type,
+)
 from constants import MAX_RETRIES, RETRY_DELAY
+from config import GENERATION_PIPELINE
+from typing import Awaitable, Callable
 from langchain_core.prompts.prompt import PromptTemplate
 from prisma.enums import AgreementStatus
+from helpers.job_manager import job_manager
 
 
 logging.basicConfig(level=logging.INFO)
@@ -39,9 +50,9 @@ class TemplateAgreementRequest(BaseModel):
     participant_email: str
 
 
-def run_agreement_tool(user_input: str, agreement_id: int) -> str:
+async def run_agreement_tool(user_input: str, agreement_id: int) -> str:
     state = {"messages": [("user", user_input)], "agreement_id": agreement_id}
-    for event in template_graph.stream(state):
+    async for event in template_graph.astream(state):
         if "create_pdf" in event:
             output = event["create_pdf"].get("messages", "No messages found")
             return output
@@ -53,7 +64,8 @@ def create_tool_with_agreement_id(agreement_id):
     return [
         Tool(
             name="generate_agreement",
-            func=lambda user_input: run_agreement_tool(user_input, agreement_id),
+            func=None,
+            coroutine=lambda user_input: run_agreement_tool(user_input, agreement_id),
             description="Generate a agreement PDF from the provided details. Output only the agreement text.",
         )
     ]
@@ -118,34 +130,33 @@ def log_after_failure(retry_state):
 @retry(
     stop=stop_after_attempt(MAX_RETRIES),
     wait=wait_fixed(RETRY_DELAY),
-    retry=retry_if_exception_type(Exception),
+    # A cancelled job stops instead of being retried
+    retry=retry_if_exception_type(Exception)
+    & retry_if_not_exception_type(JobCancelledError),
     before_sleep=log_before_retry,
     after=log_after_failure,
 )
-def generate_agreement_with_retry(agent, agreement_details, agreement_id):
+async def generate_agreement_with_retry(generate, agreement_details, agreement_id):
+    raise_if_cancelled()
     try:
-        response = agent.invoke(agreement_details)
+        response = await generate(agreement_details)
         if not response:
             raise ValueError("Empty response from LLM")
         return response
+    except JobCancelledError:
+        raise
     except Exception as e:
         logging.info(
-            f"Error while invoking agent for agreement_id {agreement_id}: {str(e)}"
+            f"Error while generating agreement_id {agreement_id}: {str(e)}"
         )
         return None
 
 
-async def template_based_agreement(
-    req: TemplateAgreementRequest, file, agreement_id: int, db: object
-):
-    try:
-        state_manager.cleanup_template_agreement_state(agreement_id)
-        state_manager.set_current_template_agreement_id(agreement_id)
-        current_state = state_manager.get_template_agreement_state(agreement_id)
-        tools = create_tool_with_agreement_id(agreement_id)
-
+def create_agreement_generator(agreement_id: int) -> Callable[[str], Awaitable[object]]:
+    """Returns the callable that turns the user prompt into the agreement PDF."""
+    if GENERATION_PIPELINE == "agent":
         agent = initialize_agent(
-            tools=tools,
+            tools=create_tool_with_agreement_id(agreement_id),
             llm=llm,
             agent=AgentType.ZERO_SHOT_REACT_DESCRIPTION,
             verbose=True,
@@ -154,21 +165,47 @@ async def template_based_agreement(
             early_stopping_method="generate",
             prompt=PromptTemplate.from_template(template),
         )
+        return agent.ainvoke
+
+    # The prompt goes to the template graph as is instead of through an agent
+    # round trip that can only decide to call it
+    return lambda user_prompt: run_agreement_tool(user_prompt, agreement_id)
+
+
+def write_template_file(content: bytes, file_name: str, agreement_id: int) -> str:
+    """Writes the uploaded template to this worker's disk for the generator to read."""
+    secure_filename = f"{agreement_id}_{os.path.basename(file_name)}"
+    base_dir = os.path.join(os.path.dirname(__file__), "temp")
+    os.makedirs(base_dir, exist_ok=True)
+    temp_file_path = os.path.join(base_dir, secure_filename)
+    with open(temp_file_path, "wb") as buffer:
+        buffer.write(content)
+    return temp_file_path
+
+
+async def template_based_agreement(
+    req: TemplateAgreementRequest, template_file_path: str, agreement_id: int, db: object
+):
+    # Set before the first await, which a cancel can interrupt
+    current_state = None
+    try:
+        # A reclaimed job restarts from scratch: whatever the interrupted attempt
+        # left behind is dropped, including the parties its emailed links point to
+        await state_manager.cleanup_template_agreement_state(agreement_id)
+        current_state = state_manager.get_template_agreement_state(agreement_id)
+        generate = create_agreement_generator(agreement_id)
         current_state.agreement_id = agreement_id
         current_state.set_authority(req.authority_email)
         current_state.set_participant(req.participant_email)
-        secure_filename = os.path.basename(file.filename)
-        base_dir = os.path.join(os.path.dirname(__file__), "temp")
-        os.makedirs(base_dir, exist_ok=True)
-        temp_file_path = os.path.join(base_dir, secure_filename)
-        with open(temp_file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        current_state.template_file_path = temp_file_path
+        current_state.template_file_path = template_file_path
         try:
             agreement_details = req.user_prompt
-            response = await execute_in_new_thread(
-                generate_agreement_with_retry, agent, agreement_details, agreement_id
-            )
+            async with generation_limiter.slot():
+                response = await generate_agreement_with_retry(
+                    generate, agreement_details, agreement_id
+                )
+        except JobCancelledError:
+            raise
         except Exception as e:
             await update_agreement_status(
                 db, agreement_id, AgreementStatus.FAILED, True
@@ -177,6 +214,10 @@ async def template_based_agreement(
                 status_code=500, detail=f"Error generating agreement: {str(e)}"
             )
 
+        # The approval links can land on any worker, so the parties must be
+        # visible in the shared store before the emails go out
+        await state_manager.save_template_agreement_state(current_state)
+
         authority_success, _ = send_email_with_attachment(
             req.authority_email,
             current_state.pdf_file_path,
@@ -203,7 +244,7 @@ async def template_based_agreement(
                 )
 
                 if approval_result == ApprovalResult.APPROVED:
-                    update_pdf_with_signatures(agreement_id)
+                    await execute_in_new_thread(update_pdf_with_signatures, agreement_id)
                     # Send final agreement emails
                     authority_success, _ = send_email_with_attachment(
                         req.authority_email,
@@ -226,7 +267,7 @@ async def template_based_agreement(
                     delete_temp_file(current_state)
                     delete_template_temp_images(current_state)
                     delete_template_file(current_state)
-                    state_manager.cleanup_template_agreement_state(agreement_id)
+                    await state_manager.cleanup_template_agreement_state(agreement_id)
                     return {"message": "Final signed agreement sent to all parties!"}
                 elif approval_result == ApprovalResult.REJECTED:
                     # If explicitly rejected
@@ -250,7 +291,7 @@ async def template_based_agreement(
                     delete_temp_file(current_state)
                     delete_template_file(current_state)
                     delete_template_temp_images(current_state)
-                    state_manager.cleanup_template_agreement_state(agreement_id)
+                    await state_manager.cleanup_template_agreement_state(agreement_id)
                     return {"message": "Agreement was rejected by one or more parties."}
                 elif approval_result == ApprovalResult.EXPIRED:
                     # ApprovalResult.EXPIRED
@@ -275,7 +316,7 @@ async def template_based_agreement(
                     delete_temp_file(current_state)
                     delete_template_file(current_state)
                     delete_template_temp_images(current_state)
-                    state_manager.cleanup_template_agreement_state(agreement_id)
+                    await state_manager.cleanup_template_agreement_state(agreement_id)
                     return {
                         "message": "Agreement was expired due to no action taken by one or more parties within 5 minutes."
                     }
@@ -301,7 +342,7 @@ async def template_based_agreement(
                     delete_temp_file(current_state)
                     delete_template_file(current_state)
                     delete_template_temp_images(current_state)
-                    state_manager.cleanup_template_agreement_state(agreement_id)
+                    await state_manager.cleanup_template_agreement_state(agreement_id)
                     return {
                         "message": "Agreement process failed due to connection issues."
                     }
@@ -327,7 +368,7 @@ async def template_based_agreement(
                 delete_temp_file(current_state)
                 delete_template_file(current_state)
                 delete_template_temp_images(current_state)
-                state_manager.cleanup_template_agreement_state(agreement_id)
+                await state_manager.cleanup_template_agreement_state(agreement_id)
                 return {
                     "message": f"Agreement process failed: Connection closed unexpectedly"
                 }
@@ -336,12 +377,39 @@ async def template_based_agreement(
                 db, agreement_id, AgreementStatus.FAILED, True
             )
             return {"message": "Error sending initial agreement emails."}
+    except (asyncio.CancelledError, JobCancelledError):
+        # A user cancel already marked the row CANCELLED. On a lost lease or a
+        # shutdown the job is reclaimed and its new run uses the state record
+        # and the template file, so they are left alone
+        if not owns_shared_state():
+            raise
+        if current_state is not None:
+            delete_temp_file(current_state)
+            delete_template_file(current_state)
+            delete_template_temp_images(current_state)
+        elif os.path.exists(template_file_path):
+            os.remove(template_file_path)
+        await state_manager.cleanup_template_agreement_state(agreement_id)
+        raise
     except Exception as e:
         await update_agreement_status(db, agreement_id, AgreementStatus.FAILED, True)
-        await create_user_agreement_status(
-            db, current_state.authority_id, agreement_id, AgreementStatus.FAILED, True
-        )
-        await create_user_agreement_status(
-            db, current_state.participant_id, agreement_id, AgreementStatus.FAILED, True
-        )
+        if current_state is not None:
+            await create_user_agreement_status(
+                db, current_state.authority_id, agreement_id, AgreementStatus.FAILED, True
+            )
+            await create_user_agreement_status(
+                db, current_state.participant_id, agreement_id, AgreementStatus.FAILED, True
+            )
         raise HTTPException(status_code=500, detail=str(e))
+
+
+async def run_template_agreement_job(job, db):
+    """Runs a queued template agreement job, restoring the template from the job row."""
+    req = TemplateAgreementRequest(**job.payload)
+    template_file_path = write_template_file(
+        job.templateFile.decode(), job.templateFileName, job.agreementId
+    )
+    return await template_based_agreement(req, template_file_path, job.agreementId, db)
+
+
+job_manager.register("template", run_template_agreement_job)
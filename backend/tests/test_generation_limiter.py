@@ -0,0 +1,37 @@
+import asyncio
+from helpers.generation_limiter import GenerationLimiter, slot_reservation
+
+
+def test_claimed_job_keeps_its_slot_until_generation_ends():
+    limiter = GenerationLimiter(max_concurrent=2)
+
+    async def run_job(reservation, generating, finish):
+        slot_reservation.set(reservation)
+        async with limiter.slot():
+            generating.set()
+            await finish.wait()
+
+    async def scenario():
+        reservation = limiter.reserve()
+        # Claimed but not generating yet: the poll loop must not claim past the cap
+        assert limiter.free_slots() == 1
+        generating, finish = asyncio.Event(), asyncio.Event()
+        task = asyncio.create_task(run_job(reservation, generating, finish))
+        await generating.wait()
+        assert (limiter.reserved, limiter.running, limiter.free_slots()) == (0, 1, 1)
+        finish.set()
+        await task
+        # Released again by the job worker once the job ends; already handed over
+        reservation.release()
+        assert limiter.free_slots() == 2
+
+    asyncio.run(scenario())
+
+
+def test_unused_reservation_is_given_back():
+    limiter = GenerationLimiter(max_concurrent=1)
+    reservation = limiter.reserve()
+    assert limiter.free_slots() == 0
+    reservation.release()
+    reservation.release()
+    assert limiter.free_slots() == 1
@@ -0,0 +1,45 @@
+import asyncio
+import pytest
+from langchain_core.messages import AIMessage
+from tenacity import wait_fixed
+import helpers.template_based_agreement_generator as template_generator
+
+CHUNK = "The Participant ____________ agrees to the terms from ___/___/20__."
+
+
+class BlockingLLM:
+    """Counts calls and leaves the first one in flight until it is cancelled."""
+
+    def __init__(self):
+        self.calls = 0
+        self.called = asyncio.Event()
+
+    async def ainvoke(self, messages):
+        self.calls += 1
+        if self.calls == 1:
+            self.called.set()
+            await asyncio.Event().wait()
+        return AIMessage(content=CHUNK)
+
+
+@pytest.fixture
+def llm(monkeypatch):
+    llm = BlockingLLM()
+    monkeypatch.setattr(template_generator, "llm", llm)
+    # Without a delay a wrongly retried cancellation calls the model again at once
+    monkeypatch.setattr(template_generator.fill_chunk.retry, "wait", wait_fixed(0))
+    return llm
+
+
+def test_cancelled_chunk_is_not_retried(llm):
+    async def cancel_in_flight():
+        task = asyncio.ensure_future(
+            template_generator.fill_chunk(CHUNK, [], asyncio.Semaphore(1))
+        )
+        await llm.called.wait()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_in_flight())
+    assert llm.calls == 1
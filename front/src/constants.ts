@@ -14,4 +14,5 @@ export const statusTooltips: Record<string, string> = {
   REJECTED: "Rejected by one or more parties",
   EXPIRED: "No action taken by one or more parties",
   FAILED: "Failed due to connection issue",
+  CANCELLED: "Cancelled before completion",
 };
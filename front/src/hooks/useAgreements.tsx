@@ -6,19 +6,19 @@ import { Agreement, TemplateAgreement } from "../types/types";
 interface AgreementContextType {
   agreements: Agreement[] | null;
   loadRentAgreemnts: boolean;
-  fetchAgreements: (method: {}) => Promise<void>;
+  fetchAgreements: (method: {}) => Promise<boolean>;
   templateAgreement: TemplateAgreement[] | null;
   loadTemplatetAgreemnts: boolean;
-  fetchTemplateAgreements: (method: {}) => Promise<void>;
+  fetchTemplateAgreements: (method: {}) => Promise<boolean>;
 }
 
 const AgreementsContext = createContext<AgreementContextType>({
   agreements: [],
   loadRentAgreemnts: false,
-  fetchAgreements: async (_method: {}) => {},
+  fetchAgreements: async (_method: {}) => false,
   templateAgreement: [],
   loadTemplatetAgreemnts: false,
-  fetchTemplateAgreements: async (_method: {}) => {},
+  fetchTemplateAgreements: async (_method: {}) => false,
 });
 
 export const AgreementsProvider = ({ children }: { children: ReactNode }) => {
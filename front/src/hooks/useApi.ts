@@ -22,7 +22,8 @@ interface ApiResponse<T> {
   data: T | null;
   error: string | null;
   loading: boolean;
-  fetchData: (options?: FetchOptions) => Promise<void>;
+  // Resolves to whether the request succeeded; failures are reported in error
+  fetchData: (options?: FetchOptions) => Promise<boolean>;
 }
 
 type HttpMethod =
@@ -49,7 +50,7 @@ const useApi = <T>(endpoint: BackendEndpoints): ApiResponse<T> => {
   const [loading, setLoading] = useState<boolean>(false);
   const { getToken } = useAuth();
 
-  const fetchData = async (options?: FetchOptions) => {
+  const fetchData = async (options?: FetchOptions): Promise<boolean> => {
     setLoading(true);
     setError(null);
     const token = await getToken();
@@ -70,12 +71,14 @@ const useApi = <T>(endpoint: BackendEndpoints): ApiResponse<T> => {
 
       const response: AxiosResponse<T> = await axios(config);
       setData(response.data);
+      return true;
     } catch (err) {
       if (axios.isAxiosError(err)) {
         setError(err.message);
       } else {
         setError(String(err));
       }
+      return false;
     } finally {
       setLoading(false);
     }
@@ -19,9 +19,9 @@ export type UserData = {
 
 interface UserContextType {
   rentAgreementUser: UserData | null;
-  getRentAgreementUser: (method: {}) => Promise<void>;
+  getRentAgreementUser: (method: {}) => Promise<boolean>;
   TemplateAgreementUser: UserData | null;
-  getTemplateAgreementUser: (method: {}) => Promise<void>;
+  getTemplateAgreementUser: (method: {}) => Promise<boolean>;
   setStatus: React.Dispatch<React.SetStateAction<string | null>>;
   status: string | null;
   loadRentAgreemntUser: boolean;
@@ -30,9 +30,9 @@ interface UserContextType {
 
 const UserContext = createContext<UserContextType>({
   rentAgreementUser: null,
-  getRentAgreementUser: () => Promise.resolve(),
+  getRentAgreementUser: () => Promise.resolve(false),
   TemplateAgreementUser: null,
-  getTemplateAgreementUser: () => Promise.resolve(),
+  getTemplateAgreementUser: () => Promise.resolve(false),
   setStatus: () => {},
   status: null,
   loadRentAgreemntUser: false,
@@ -1,23 +1,52 @@
 import { useEffect, useRef, useCallback } from "react";
 
-const useWebSocket = (url: string, onMessage: (message: any) => void) => {
+const useWebSocket = (
+  url: string,
+  onMessage: (message: any) => void,
+  getToken: () => Promise<string | null> = async () => null
+) => {
   const ws = useRef<WebSocket | null>(null);
   const reconnectTimeout = useRef<number | undefined>(undefined);
   const reconnectAttempts = useRef<number>(0);
+  // Last event sequence number seen, sent on reconnect so the server replays the gap
+  const lastSeq = useRef<number | null>(null);
   const MAX_RECONNECT_ATTEMPTS = 5;
+  // Kept in a ref so a new getToken identity does not reconnect the socket
+  const getTokenRef = useRef(getToken);
+  getTokenRef.current = getToken;
 
   const connect = useCallback(() => {
     try {
-      ws.current = new WebSocket(url);
+      let connectUrl = url;
+      if (lastSeq.current !== null) {
+        const separator = url.includes("?") ? "&" : "?";
+        connectUrl = `${url}${separator}last_seq=${lastSeq.current}`;
+      }
+      ws.current = new WebSocket(connectUrl);
 
-      ws.current.onopen = () => {
+      const socket = ws.current;
+      socket.onopen = async () => {
         console.log("WebSocket connection opened");
         reconnectAttempts.current = 0;
+        // The server waits for this before subscribing; the token is sent as a
+        // message so it never appears in URLs or access logs
+        const token = await getTokenRef.current();
+        if (socket.readyState === WebSocket.OPEN) {
+          socket.send(JSON.stringify({ type: "auth", token }));
+        }
       };
 
       ws.current.onmessage = (event) => {
         try {
           const message = JSON.parse(event.data);
+          // Answer server heartbeats so the connection is not reaped as idle
+          if (message.type === "ping") {
+            ws.current?.send("pong");
+            return;
+          }
+          if (typeof message.seq === "number") {
+            lastSeq.current = message.seq;
+          }
           onMessage(message);
         } catch (error) {
           console.error("Error parsing WebSocket message:", error);
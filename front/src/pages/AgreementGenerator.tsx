@@ -25,6 +25,7 @@ import { useForm } from "@mantine/form";
 import { DatePickerInput } from "@mantine/dates";
 import { COLORS } from "../colors";
 import useApi, { BackendEndpoints } from "../hooks/useApi";
+import { randomUUID } from "../utils/randomUUID";
 import { useAgreements } from "../hooks/useAgreements";
 import { OTPInput } from "../components/agreements/OTPInput";
 import { useUser } from "@clerk/clerk-react";
@@ -45,6 +46,9 @@ export function AgreementGenerator() {
   const [showMessage, setShowMessage] = useState(false);
   const { colorScheme } = useMantineColorScheme();
   const { fetchData } = useApi(BackendEndpoints.CreateAgreement);
+  // Shared by repeated submits of the same form so retries and double-clicks
+  // attach to the first job instead of generating the agreement twice
+  const idempotencyKey = useRef(randomUUID());
   const { fetchAgreements } = useAgreements();
   const { data, fetchData: verifyOTP } = useApi<OTPVerificationResponse>(
     BackendEndpoints.VerifyOTP
@@ -629,10 +633,13 @@ export function AgreementGenerator() {
       user_id: user?.id,
     };
     try {
-      await fetchData({
+      const created = await fetchData({
         method: "POST",
         data: requestData,
+        headers: { "Idempotency-Key": idempotencyKey.current },
       });
+      // A failed request keeps its key, so retrying it cannot create a second agreement
+      if (created) idempotencyKey.current = randomUUID();
       await fetchAgreements({ method: "GET", params: { user_id: user?.id } });
     } catch (error) {
       console.error("Error creating agreement:", error);
@@ -1016,6 +1023,7 @@ export function AgreementGenerator() {
                     <Button
                       onClick={() => {
                         form.reset();
+                        idempotencyKey.current = randomUUID();
                         setActive(0);
                         setShowMessage(false);
                         setIsSubmitting(false);
@@ -1,5 +1,6 @@
 import { useCallback, useState, useEffect, useRef } from "react";
 import { useParams, useSearchParams } from "react-router-dom";
+import { useAuth } from "@clerk/clerk-react";
 import { useForm } from "@mantine/form";
 import { IconAlertTriangle } from "@tabler/icons-react";
 import {
@@ -153,7 +154,8 @@ const ApprovalPage = () => {
   };
 
   const onMessage = useCallback((message: any) => {
-    if (message.status === "FAILED" || message.status === "EXPIRED" || message.status === "REJECTED" ) {
+    // "resync" means events were missed while disconnected and could not be replayed
+    if (message.type === "resync" || message.status === "FAILED" || message.status === "EXPIRED" || message.status === "REJECTED" ) {
       if (isRentAgreement) {
         getRentAgreementUser({ method: "GET", params: { agreement_id: param.agreementId, user_id: param.id } });
       } else {
@@ -162,7 +164,12 @@ const ApprovalPage = () => {
     }
   }, [param.agreementId, isRentAgreement]);
 
-  useWebSocket(websocket_url, onMessage);
+  const agreementChannelUrl = `${websocket_url}?${new URLSearchParams({
+    agreement_id: param.agreementId ?? "",
+    agreement_type: isRentAgreement ? "rent" : "template",
+  })}`;
+  const { getToken } = useAuth();
+  useWebSocket(agreementChannelUrl, onMessage, getToken);
 
   // Get the current status from either the agreement or user state
   const currentStatus = agreement?.status || user?.status || status;
@@ -23,6 +23,7 @@ import {
   IconAlertTriangle,
 } from "@tabler/icons-react";
 import useApi, { BackendEndpoints } from "../hooks/useApi";
+import { randomUUID } from "../utils/randomUUID";
 import { COLORS } from "../colors";
 import { useForm } from "@mantine/form";
 import { useAgreements } from "../hooks/useAgreements";
@@ -58,6 +59,9 @@ export function Templates() {
     setShowAlert(false);
   };
   const { fetchData } = useApi(BackendEndpoints.CreateTemplateBasedAgreement);
+  // Shared by repeated submits of the same form so retries and double-clicks
+  // attach to the first job instead of generating the agreement twice
+  const idempotencyKey = useRef(randomUUID());
   const { fetchData: sendOTP } = useApi(BackendEndpoints.SentOTP);
   const { data, fetchData: verifyOTP } = useApi<OTPVerificationResponse>(
     BackendEndpoints.VerifyOTP
@@ -267,10 +271,13 @@ export function Templates() {
       formData.append("file", form.values.file ? form.values.file : "");
       formData.append("user_id", user?.id ?? "");
 
-      await fetchData({
+      const created = await fetchData({
         method: "POST",
         data: formData,
+        headers: { "Idempotency-Key": idempotencyKey.current },
       });
+      // A failed request keeps its key, so retrying it cannot create a second agreement
+      if (created) idempotencyKey.current = randomUUID();
 
       await fetchTemplateAgreements({
         method: "GET",
@@ -362,6 +369,7 @@ export function Templates() {
               <Button
                 onClick={() => {
                   form.reset();
+                  idempotencyKey.current = randomUUID();
                   setFile(null);
                   setDisplayBanner(false);
                   clearInterval(countdownTimers.current["authority"]);